@@ -0,0 +1,90 @@
+#! /usr/bin/env python3.5
+""" Adds the city and state columns the scraper now writes to the csvs of
+    every city directory that were written without them, replacing
+    add_city_to_review.sh. Reviews get city and state, listings get state
+    (they already had city). Each file is streamed through the csv module,
+    so commas in quoted titles are left alone, and then swapped in for the
+    old one. Files that already have the columns are left as they are, so
+    it's safe to run more than once.
+
+    usage: add_city_state.py [--workers N] [directory]
+"""
+
+import argparse
+import csv
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from scraper import CityScrape
+
+
+# kind -> (the columns the csvs had, the columns they have now)
+KINDS = {
+    'listing': (CityScrape.LISTING_FIELDNAMES[:-1], CityScrape.LISTING_FIELDNAMES),
+    'review': (CityScrape.REVIEW_FIELDNAMES[:-2], CityScrape.REVIEW_FIELDNAMES),
+}
+
+
+def split_city_dir(directory):
+    """ Undoes scraper.get_city_dir
+        :returns: the city and state a city directory is for
+    """
+    city, state = os.path.basename(os.path.normpath(directory)).rsplit('_', 1)
+    return city.replace('_', ' '), state
+
+def add_columns(path, kind):
+    """ Rewrites the csv at path with the columns added
+        :returns: the logging level and a line saying what was done with
+                  the file
+    """
+    oldFieldnames, fieldnames = KINDS[kind]
+    city, state = split_city_dir(os.path.dirname(path))
+    values = { 'city': city, 'state': state }
+    added = fieldnames[len(oldFieldnames):]
+    extra = [ values[name] for name in added ]
+
+    tmpPath = path + '.tmp'
+    with open(path, newline='') as oldFile:
+        rows = csv.reader(oldFile)
+        header = next(rows, None)
+        if header == fieldnames:
+            return logging.INFO, "{} already has the columns".format(path)
+        if header != oldFieldnames:
+            return logging.ERROR, "{} has columns we don't know, {}. Left it alone.".format(
+                    path, header)
+
+        with open(tmpPath, 'w', newline='') as newFile:
+            writer = csv.writer(newFile, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(fieldnames)
+            count = 0
+            for row in rows:
+                writer.writerow(row + extra)
+                count += 1
+            newFile.flush()
+            os.fsync(newFile.fileno())
+    os.replace(tmpPath, path)
+    return logging.INFO, "Added {} to {} rows of {}".format(', '.join(added), count, path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default='.',
+                        help="directory holding the city directories")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes to rewrite files in (defaults to the "
+                             "number of cpus)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s %(message)s')
+
+    jobs = []
+    for kind in KINDS:
+        for path in sorted(glob.glob(os.path.join(args.directory, '*', '*_{}.csv'.format(kind)))):
+            jobs.append((path, kind))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for level, message in executor.map(add_columns, *zip(*jobs)) if jobs else ():
+            logging.log(level, message)
+
+if __name__ == "__main__":
+    main()
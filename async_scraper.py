@@ -0,0 +1,166 @@
+#! /usr/bin/env python3.5
+
+import asyncio
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from scraper import LISTING_ERRORS, CityScrape
+
+
+class AsyncCityScrape(CityScrape):
+    """ Scrapes the same data as CityScrape, but fetches the search pages,
+        listing pages and reviews for a city concurrently. Listings are still
+        written to the csvs in href order, so the output is identical to the
+        sync scraper's.
+    """
+
+    def __init__(self, max_in_flight=8, pool_size=None, parser=None, **kwargs):
+        self.max_in_flight = max_in_flight
+        self.host_semaphores = {}
+        self.host_semaphores_lock = threading.Lock()
+        # keep a connection open for every request that can be in flight
+        super().__init__(pool_size=pool_size or max_in_flight, parser=parser,
+                         **kwargs)
+
+    def get_host_semaphore(self, url):
+        """ Returns the semaphore limiting the requests in flight to the
+            host of url
+        """
+        host = urlparse(url).netloc
+        with self.host_semaphores_lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_in_flight)
+            return self.host_semaphores[host]
+
+    def request_url(self, url, params=None, headers=None):
+        with self.get_host_semaphore(url):
+            return super().request_url(url, params=params, headers=headers)
+
+    def get_all_reviews_from_listing(self, apiListingId, href, row):
+        """ Gets all the review rows while still on a fetch thread, so the
+            event loop doesn't end up fetching pages while writing them.
+            This holds every row of the listing, however its pages were
+            decoded.
+        """
+        row, review_rows = super().get_all_reviews_from_listing(apiListingId, href, row)
+        return row, list(review_rows)
+
+    def get_reviews_for_listing(self, href):
+        row, review_rows = super().get_reviews_for_listing(href)
+        return row, list(review_rows)
+
+    def run(self, coro_func, *args):
+        """ Runs coro_func on a fresh event loop with a thread pool to run
+            the blocking fetches in
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                return loop.run_until_complete(coro_func(loop, executor, *args))
+        finally:
+            loop.close()
+
+    def get_all_listings_for_cur_city(self):
+        """ Same as CityScrape.get_all_listings_for_cur_city, but fetches all
+            the pages of results after the first at once
+            :returns: hrefs of all the listings for a city
+        """
+        return self.run(self.fetch_all_listings_for_cur_city)
+
+    async def fetch_all_listings_for_cur_city(self, loop, executor):
+        firstPage, morePages = await self.fetch_result_pages(loop, executor)
+        seen = set()
+        listingHrefs = self.get_new_hrefs(firstPage, seen)
+        # gather keeps the pages in order, so the hrefs are in the same order
+        # the sync scraper would find them in
+        for soup in await asyncio.gather(*morePages):
+            listingHrefs += self.get_new_hrefs(soup, seen)
+        self.save_hrefs(listingHrefs)
+        return listingHrefs
+
+    async def fetch_result_pages(self, loop, executor):
+        """ Fetches the first page of results for the current city, and
+            starts fetching the rest of them once it says how many there are
+            :returns: the first page, and futures for the rest in order
+        """
+        firstPage = await loop.run_in_executor(executor, self.request_city_listing,
+                                               self.cur_city, self.cur_state)
+        pageCount = self.read_page_count(firstPage, self.cur_city, self.cur_state)
+        morePages = [ loop.run_in_executor(executor, self.request_city_listing,
+                                           self.cur_city, self.cur_state, page)
+                      for page in range(2, pageCount + 1) ]
+        return firstPage, morePages
+
+    def search_and_scrape_cur_city(self):
+        self.run(self.search_and_fetch_cur_city)
+
+    async def search_and_fetch_cur_city(self, loop, executor):
+        """ Starts fetching the listings of the first page of results while
+            the rest of the pages are still being fetched
+        """
+        firstPage, morePages = await self.fetch_result_pages(loop, executor)
+        seen = set()
+        listingHrefs = self.get_new_hrefs(firstPage, seen)
+        await self.fetch_all_listing_data_for_city(loop, executor, listingHrefs,
+                                                   morePages, seen)
+
+    def get_all_listing_data_for_city(self, listingHrefs):
+        # return because the last href we visited was the last
+        # one of the city
+        if self.last_href_num >= len(listingHrefs):
+            return
+
+        self.run(self.fetch_all_listing_data_for_city, listingHrefs)
+
+    async def fetch_all_listing_data_for_city(self, loop, executor, listingHrefs,
+                                              morePages=None, seen=None):
+        """ Keeps up to twice max_in_flight listings being fetched, and writes
+            them out as the oldest one finishes so the csvs stay in href order.
+            The new hrefs of morePages, futures for pages of results still
+            being fetched, are added to listingHrefs as each one comes in,
+            and saved once they all have.
+        """
+        window = 2 * self.max_in_flight
+        pending = collections.deque()
+        idx = self.last_href_num
+        pages = iter(morePages or [])
+        while True:
+            for href in listingHrefs[idx:]:
+                pending.append((idx, href, self.fetch_listing(loop, executor, href)))
+                idx += 1
+                if len(pending) >= window:
+                    await self.write_oldest_listing(pending)
+            page = next(pages, None)
+            if page is None:
+                break
+            listingHrefs += self.get_new_hrefs(await page, seen)
+        if morePages is not None:
+            self.save_hrefs(listingHrefs)
+
+        while pending:
+            await self.write_oldest_listing(pending)
+
+    def fetch_listing(self, loop, executor, href):
+        """ :returns: a future for the listing data and review rows of href
+        """
+        return loop.run_in_executor(executor, self.get_data_for_listing, href)
+
+    async def write_oldest_listing(self, pending):
+        idx, href, future = pending.popleft()
+        try:
+            listing_data, review_rows = await future
+        except LISTING_ERRORS as e:
+            # the pipeline fetches listings without get_data_for_listing,
+            # which would have given up on them already
+            self.give_up_on_listing(href, e)
+            listing_data, review_rows = None, []
+        except:
+            logging.error("Failed to get data for %s", href)
+            # don't leave the rest of the fetches running after we give up
+            for _, _, other in pending:
+                other.cancel()
+            raise
+        self.write_listing_data(idx, href, listing_data, review_rows)
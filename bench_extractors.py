@@ -0,0 +1,147 @@
+#! /usr/bin/env python3.5
+""" Times the listing field extraction over saved listing pages, comparing
+    the old eval'd LISTING_ATTRS strings with the extractor registry, and
+    html.parser with the faster parsers. Also checks every combination
+    extracts the same rows as LISTING_ATTRS over html.parser, and exits
+    non-zero if any of them don't.
+
+    usage: bench_extractors.py <directory of saved listing .html pages>
+"""
+
+import argparse
+import glob
+import logging
+import os.path
+import re
+import sys
+import time
+from bs4 import BeautifulSoup
+
+from extractors import ListingPage, extract_listing
+from scraper import CityScrape, pick_parser
+
+
+# the LISTING_ATTRS table get_data_for_listing used to eval, kept here so
+# there is something to compare the extractors against
+LEGACY_LISTING_ATTRS = {
+    'listing_id': "href[1:]",
+    'listing_title':"soup.find('span', class_='listing-headline-text').text.strip()",
+    'latitude':"float(soup.find('meta', attrs={'property': 'homeaway:location:latitude'})['content'])",
+    'longitude':"float(soup.find('meta', attrs={'property': 'homeaway:location:longitude'})['content'])",
+    'location_name':"soup.find('a', class_='js-breadcrumbLink').text.strip()",
+    'number_reviews':"numReviews",
+    'average_rating':"float(re.search('(\\d*\\.\\d*)', soup.find('div', class_='rating')['title']).group(0))",
+    'average_nightly_price':"int(soup.find('div', class_='price-large').text.strip()[1:])",
+    'min_stay':"int(re.search('\\d+', soup.find(text = 'Minimum Stay').parent.nextSibling.nextSibling.text).group())",
+    'sleeps':"int(soup.find(text = 'Sleeps').parent.nextSibling.text)",
+    'bedrooms':"soup.find(text = 'Bedrooms').parent.nextSibling.nextSibling.text",
+    'bathrooms':"int(soup.find(text = 'Bathrooms').parent.nextSibling.text)",
+    'property_type':"soup.find('div', id='propertyType').nextSibling.nextSibling.find('li').text.strip()",
+    'internet':"'Yes' if soup.find(text=re.compile('Internet')) else 'No'",
+    'member_since':"re.search('(\\d+)', soup.find('div', class_='advertiser-date').text.strip()).group(1)",
+    'response_time':"soup.find(text=re.compile('response time', re.IGNORECASE)).parent.find('strong').text",
+    'response_rate':"soup.find(text=re.compile('Response rate')).parent.find('strong').text",
+    'calendar_last_updated':"soup.find(text=re.compile('Calendar last updated')).parent.find('strong').text",
+    'type':"soup.find('div', id='propertyType').nextSibling.nextSibling.find('li').text.strip()",
+    'floor':"re.search('(\\d+)', soup.find('div', id='propertyType').nextSibling.nextSibling.nextSibling.nextSibling.find('li').text).group(1)",
+    'sq_footage':"re.search('\\d+', soup.find('div', text='Floor Area:').nextSibling.nextSibling.find('li').text).group(0)",
+    'max_occupancy':"int(soup.find(text=re.compile('Max. occupancy')).parent.find('span').text.strip())",
+    'building_type':"soup.find('div', id='buildingtype').nextSibling.nextSibling.find('li').text.strip()",
+    'nightly': "re.search('\\d+',soup.find('div', class_='ratePeriodTitle', text=re.compile('standard', re.IGNORECASE)).parent.parent.find('td', class_='nightly').find(class_='rate').text).group()",
+    'weekend_night': "re.search('\\d+',soup.find('div', class_='ratePeriodTitle', text=re.compile('standard', re.IGNORECASE)).parent.parent.find('td', class_='weekendNight').find(class_='rate').text).group()",
+    'property_protection_fee':"re.search('\\d+', soup.find(class_='additionalInfo').find(text=re.compile('property protection', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
+    'cleaning_fee':"re.search('\\d+', soup.find(class_='additionalInfo').find(text=re.compile('cleaning fee', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
+    'tax_rate':"re.search('\\d+[.]?\\d*%', soup.find(class_='additionalInfo').find(text=re.compile('tax rate', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
+    'city':"city",
+}
+
+
+def legacy_extract(soup, href, numReviews, city):
+    row = {}
+    for attr, code in LEGACY_LISTING_ATTRS.items():
+        try:
+            row[attr] = eval(code)
+        except:
+            row[attr] = ''
+    return row
+
+
+def registry_extract(soup, href, numReviews, city):
+    return extract_listing(ListingPage(soup, href, city, numReviews))
+
+
+def best_time(func, repeat):
+    """ :returns: the best time out of repeat runs of func, and what it
+                  returned
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(name, seconds, count, baseline):
+    print("{:32} {:8.2f} ms/listing {:6.2f}x".format(
+            name, 1000 * seconds / count, baseline / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages_dir')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--parser', choices=CityScrape.PARSERS, default=None,
+                        help="parser to compare with html.parser (defaults "
+                             "to the fastest one installed)")
+    args = parser.parse_args()
+    fastParser = args.parser or pick_parser(CityScrape.PARSERS)
+
+    # the missing fields would otherwise log an error per page
+    logging.disable(logging.ERROR)
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.pages_dir, '*.html'))):
+        href = '/' + os.path.splitext(os.path.basename(path))[0]
+        with open(path) as page:
+            pages.append((href, page.read()))
+    if not pages:
+        parser.error("no .html pages found in {}".format(args.pages_dir))
+
+    def parse(parserName):
+        return lambda: [ (href, BeautifulSoup(html, parserName)) for href, html in pages ]
+
+    def extract(extractFunc, soups):
+        return lambda: [ extractFunc(soup, href, 0, 'bench') for href, soup in soups ]
+
+    parsers = ['html.parser'] if fastParser == 'html.parser' else ['html.parser', fastParser]
+    print("{} pages".format(len(pages)))
+    baseline = None
+    expected = None
+    mismatches = 0
+    for parserName in parsers:
+        parseTime, soups = best_time(parse(parserName), args.repeat)
+        if parserName == 'html.parser':
+            baseline, expected = best_time(extract(legacy_extract, soups), args.repeat)
+            report("parse with html.parser", parseTime, len(pages), parseTime)
+            report("eval'd LISTING_ATTRS", baseline, len(pages), baseline)
+            htmlParserTime = parseTime
+        else:
+            report("parse with " + parserName, parseTime, len(pages), htmlParserTime)
+
+        registry, rows = best_time(extract(registry_extract, soups), args.repeat)
+        report("extractor registry (" + parserName + ")", registry, len(pages), baseline)
+        for (href, _), row, expectedRow in zip(pages, rows, expected):
+            # the registry has columns added since, like state
+            row = { attr: row.get(attr) for attr in expectedRow }
+            if row != expectedRow:
+                diffs = [ attr for attr in expectedRow if row.get(attr) != expectedRow[attr] ]
+                print("MISMATCH {} with {}: {}".format(href, parserName, ', '.join(diffs)))
+                mismatches += 1
+    if mismatches:
+        sys.exit("{} rows didn't match the ones LISTING_ATTRS extracts".format(mismatches))
+
+if __name__ == "__main__":
+    main()
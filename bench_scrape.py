@@ -0,0 +1,119 @@
+#! /usr/bin/env python3.5
+""" Times the whole scrape, from the search pages to the written rows, for
+    the cities of a recorded corpus served by mock_vrbo, so a change can be
+    measured without going near vrbo.com. Each run scrapes into a fresh
+    directory in a process of its own, and reports listings/second, the
+    CPU time used and the peak RSS.
+
+    usage: bench_scrape.py [--corpus bench_corpus] [--runs 3] [--latency S]
+                           [--error-rate F] [-- scraper.py flags]
+
+    The rate limiter would otherwise be what's measured, so the scraper runs
+    with --rate 1000 --max-rate 1000 unless other rates are passed.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from log_config import stop_logging
+from mock_vrbo import Corpus, start_server
+
+
+# flags the scraper gets before the ones passed in, which win over them
+DEFAULT_SCRAPER_FLAGS = ['--rate', '1000', '--max-rate', '1000']
+
+
+def run_scrape(baseUrl, cities, scraperFlags, outputDir, results):
+    """ Scrapes cities from baseUrl in a child process, and puts how long it
+        took and what it used on results
+    """
+    import scraper
+    scraper.CityScrape.BASE_URL = baseUrl
+    scraper.CityScrape.BASE_SEARCH_URL = baseUrl + '/vacation-rentals'
+    scraper.CityScrape.AJAX_URL = baseUrl + '/ajax/review/unit/{}/getAllReviews'
+    scraper.CityScrape.CITY_LIST = cities
+    os.chdir(outputDir)
+    sys.argv = ['scraper.py'] + scraperFlags
+    args = scraper.parse_args()
+
+    start = time.perf_counter()
+    cityScraper = scraper.get_scraper(args)
+    try:
+        # the missing fields and retries would drown out the results, they
+        # still go to the run's log file
+        cityScraper.console.setLevel(logging.CRITICAL)
+        scraper.run_profiled(cityScraper.scrape, args.profile, args.profile_output)
+        elapsed = time.perf_counter() - start
+    finally:
+        # the process exits without running atexit, which would leave the
+        # log listener reading a queue that's gone
+        stop_logging()
+
+    listings = 0
+    for path in glob.glob(os.path.join('*', '*_metrics.json')):
+        with open(path) as metricsFile:
+            listings += json.load(metricsFile)['counters'].get('listings', 0)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    # the parser processes of pipeline mode
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results.put({'seconds': elapsed,
+                 'listings': listings,
+                 'cpu_seconds': own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+                 # in KiB on linux
+                 'peak_rss_mb': max(own.ru_maxrss, children.ru_maxrss) / 1024})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'bench_corpus'))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds the mock server waits before each response")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests the mock server fails")
+    parser.add_argument('--json', action='store_true',
+                        help="print each run as a line of json")
+    parser.add_argument('scraper_flags', nargs=argparse.REMAINDER,
+                        help="flags for scraper.py, after a --")
+    args = parser.parse_args()
+    scraperFlags = DEFAULT_SCRAPER_FLAGS + [ flag for flag in args.scraper_flags if flag != '--' ]
+
+    corpus = Corpus(args.corpus)
+    server, baseUrl = start_server(corpus, latency=args.latency, error_rate=args.error_rate)
+    # a fresh interpreter for each run, so the RSS is only the scrape's
+    context = multiprocessing.get_context('spawn')
+    best = None
+    for runNum in range(1, args.runs + 1):
+        results = context.Queue()
+        with tempfile.TemporaryDirectory() as outputDir:
+            process = context.Process(target=run_scrape, args=(baseUrl, corpus.cities,
+                                                               scraperFlags, outputDir, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                sys.exit("Run {} failed".format(runNum))
+            result = results.get()
+        result['listings_per_second'] = result['listings'] / result['seconds']
+        if args.json:
+            print(json.dumps(result, sort_keys=True))
+        else:
+            print("run {}: {listings} listings in {seconds:.2f}s, {listings_per_second:.1f} "
+                  "listings/s, {cpu_seconds:.2f}s cpu, {peak_rss_mb:.0f} MB peak RSS".format(
+                        runNum, **result))
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    server.shutdown()
+    if not args.json:
+        print("best: {listings_per_second:.1f} listings/s".format(**best))
+
+if __name__ == "__main__":
+    main()
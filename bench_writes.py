@@ -0,0 +1,129 @@
+#! /usr/bin/env python3.5
+""" Times writing the rows of the biggest listing and review csvs of the
+    city directories through CsvSink, comparing a write per row like it
+    used to do with the batches its flush policy makes. The rows are synced
+    every --checkpoint-every listings, like the scraper does. Also checks
+    both ways write the same csv, and exits non-zero if they don't.
+
+    usage: bench_writes.py [--repeat 5] [--checkpoint-every 25] [directory]
+"""
+
+import argparse
+import csv
+import filecmp
+import glob
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+from scraper import CityScrape
+from sinks import CsvSink, FlushPolicy
+
+
+class RowAtATimeSink:
+    """ CsvSink as it was before it held rows, kept here so there is
+        something to compare against
+    """
+
+    def __init__(self, path, fieldnames):
+        self.file = open(path, 'a')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames,
+                                     quoting=csv.QUOTE_MINIMAL)
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def find_biggest(directory, kind):
+    """ :returns: the path of the biggest csv of kind in the city directories """
+    paths = glob.glob(os.path.join(directory, '*', '*_{}.csv'.format(kind)))
+    return max(paths, key=os.path.getsize) if paths else None
+
+def read_listings(path):
+    """ :returns: the columns of a city csv, and its rows grouped by the
+                  listing they're for, in order
+    """
+    with open(path, newline='') as cityFile:
+        rows = csv.DictReader(cityFile)
+        listings = [ list(group) for _, group in
+                     itertools.groupby(rows, key=lambda row: row['listing_id']) ]
+        return rows.fieldnames, listings
+
+def write_all(sink, listings, checkpointEvery):
+    for listingNum, rows in enumerate(listings, 1):
+        for row in rows:
+            sink.writerow(row)
+        if checkpointEvery and listingNum % checkpointEvery == 0:
+            sink.sync()
+    sink.sync()
+    sink.close()
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default='.',
+                        help="directory holding the city directories")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--checkpoint-every', type=int,
+                        default=CityScrape.DEFAULT_CHECKPOINT_EVERY,
+                        help="listings between syncs, 0 to only sync at the end")
+    parser.add_argument('--batch-rows', type=int, default=FlushPolicy.DEFAULT_MAX_ROWS)
+    args = parser.parse_args()
+    policy = FlushPolicy(max_rows=args.batch_rows)
+
+    mismatches = []
+    with tempfile.TemporaryDirectory() as outputDir:
+        for kind in ('listing', 'review'):
+            path = find_biggest(args.directory, kind)
+            if path is None:
+                parser.error("no {} csvs found in {}".format(kind, args.directory))
+            fieldnames, listings = read_listings(path)
+            rowCount = sum(len(rows) for rows in listings)
+            megabytes = os.path.getsize(path) / 1024 ** 2
+            print("{}: {} rows of {} listings, {:.1f} MB".format(
+                    path, rowCount, len(listings), megabytes))
+
+            outputs = {}
+            baseline = None
+            for name, makeSink in (('a write per row', RowAtATimeSink),
+                                   ('batched', lambda path_, fieldnames_: CsvSink(
+                                            path_, fieldnames_, flush_policy=policy))):
+                outputs[name] = os.path.join(outputDir, '{}_{}.csv'.format(kind, len(outputs)))
+
+                def run():
+                    if os.path.exists(outputs[name]):
+                        os.remove(outputs[name])
+                    write_all(makeSink(outputs[name], fieldnames), listings, args.checkpoint_every)
+                seconds = best_time(run, args.repeat)
+                baseline = baseline or seconds
+                print("  {:16} {:10.0f} rows/s {:7.1f} MB/s {:6.2f}x".format(
+                        name, rowCount / seconds, megabytes / seconds, baseline / seconds))
+            if not filecmp.cmp(*outputs.values(), shallow=False):
+                print("  MISMATCH: the batched csv isn't the same")
+                mismatches.append(kind)
+    if mismatches:
+        sys.exit("The batched csv wasn't the same for the {} rows".format(' and '.join(mismatches)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+""" An append-only journal of how far through a city the scraper has got.
+
+    Each line is written only after the csv rows it covers have been flushed
+    and fsynced, and records how long the csvs were at that point. Resuming
+    from the last line and cutting the csvs back to those lengths gives
+    exactly the rows of the listings the line says are done, even if the
+    scraper died while writing more.
+"""
+
+import json
+import logging
+import os
+
+
+class CheckpointJournal:
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, city, state, nextHrefNum, lastHref, offsets):
+        """ Records that the listings before nextHrefNum are all written, and
+            the csv lengths (name -> bytes) they take up
+        """
+        entry = {'city': city, 'state': state, 'next_href_num': nextHrefNum,
+                 'last_href': lastHref, 'offsets': offsets}
+        with open(self.path, 'a') as journal:
+            journal.write(json.dumps(entry, sort_keys=True) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def read_last(self, city, state):
+        """ :returns: the last complete entry for the city, or None """
+        last = None
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    # a crash mid-write leaves a line with no newline
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logging.error("Skipping unreadable checkpoint entry: %s", line)
+                        continue
+                    if entry['city'] == city and entry['state'] == state:
+                        last = entry
+        except FileNotFoundError:
+            pass
+        return last
+
+    def clear(self):
+        """ Forgets every entry, once the city they're for is done """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
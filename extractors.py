@@ -0,0 +1,327 @@
+""" Extractors for the fields of a listing page. Each extractor takes a
+    ListingPage and returns the value of one or more fields of the listing
+    csv. The regexes are compiled once here instead of for every listing, and
+    the nodes the extractors start from are found in one walk over the page
+    rather than a soup.find per field.
+"""
+
+import collections
+import itertools
+import logging
+import re
+import time
+from bs4 import NavigableString, Tag
+
+
+DIGITS_RE = re.compile(r'\d+')
+FIRST_NUMBER_RE = re.compile(r'(\d+)')
+DECIMAL_RE = re.compile(r'(\d*\.\d*)')
+PERCENT_RE = re.compile(r'\d+[.]?\d*%')
+INTERNET_RE = re.compile('Internet')
+RESPONSE_TIME_RE = re.compile('response time', re.IGNORECASE)
+RESPONSE_RATE_RE = re.compile('Response rate')
+CALENDAR_UPDATED_RE = re.compile('Calendar last updated')
+MAX_OCCUPANCY_RE = re.compile('Max. occupancy')
+STANDARD_RE = re.compile('standard', re.IGNORECASE)
+PROPERTY_PROTECTION_RE = re.compile('property protection', re.IGNORECASE)
+CLEANING_FEE_RE = re.compile('cleaning fee', re.IGNORECASE)
+TAX_RATE_RE = re.compile('tax rate', re.IGNORECASE)
+
+
+def has_class(tag, cls):
+    return cls in tag.get('class', ())
+
+
+def string_matches(tag, pattern):
+    """ Matches a tag's .string the same way find(string=pattern) does """
+    return tag.string is not None and pattern.search(tag.string) is not None
+
+
+# tag name (None for any tag) -> [(key, predicate)] for the tags the
+# extractors start from. The first tag matching each predicate is what
+# soup.find would have returned.
+TAG_TARGETS = {
+    'li': [('favorite_button', lambda tag: has_class(tag, 'dropdown') and
+                                           has_class(tag, 'favorite-button') and
+                                           has_class(tag, 'js-favoriteButtonView'))],
+    'meta': [('latitude', lambda tag: tag.get('property') == 'homeaway:location:latitude'),
+             ('longitude', lambda tag: tag.get('property') == 'homeaway:location:longitude')],
+    'span': [('listing_title', lambda tag: has_class(tag, 'listing-headline-text'))],
+    'a': [('location_name', lambda tag: has_class(tag, 'js-breadcrumbLink'))],
+    'div': [('rating', lambda tag: has_class(tag, 'rating')),
+            ('price', lambda tag: has_class(tag, 'price-large')),
+            ('property_type', lambda tag: tag.get('id') == 'propertyType'),
+            ('advertiser_date', lambda tag: has_class(tag, 'advertiser-date')),
+            ('floor_area', lambda tag: tag.string == 'Floor Area:'),
+            ('building_type', lambda tag: tag.get('id') == 'buildingtype'),
+            ('standard_rate_title', lambda tag: has_class(tag, 'ratePeriodTitle') and
+                                                string_matches(tag, STANDARD_RE))],
+    None: [('additional_info', lambda tag: has_class(tag, 'additionalInfo'))],
+}
+
+# key -> predicate for the strings the extractors start from
+STRING_TARGETS = [
+    ('min_stay', lambda text: text == 'Minimum Stay'),
+    ('sleeps', lambda text: text == 'Sleeps'),
+    ('bedrooms', lambda text: text == 'Bedrooms'),
+    ('bathrooms', lambda text: text == 'Bathrooms'),
+    ('internet', INTERNET_RE.search),
+    ('response_time', RESPONSE_TIME_RE.search),
+    ('response_rate', RESPONSE_RATE_RE.search),
+    ('calendar_last_updated', CALENDAR_UPDATED_RE.search),
+    ('max_occupancy', MAX_OCCUPANCY_RE.search),
+]
+
+
+def index_page(soup):
+    """ Walks the page once, finding the first node for each of the
+            TAG_TARGETS and STRING_TARGETS
+        :returns: key -> node for the targets that were found
+    """
+    found = {}
+    anyTagTargets = TAG_TARGETS[None]
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            targets = TAG_TARGETS.get(node.name, ())
+            for key, matches in itertools.chain(targets, anyTagTargets):
+                if key not in found and matches(node):
+                    found[key] = node
+        elif isinstance(node, NavigableString):
+            for key, matches in STRING_TARGETS:
+                if key not in found and matches(node):
+                    found[key] = node
+    return found
+
+
+class ListingPage:
+    """ A parsed listing page and what we know about it from elsewhere.
+        The nodes the extractors start from are found in a single walk over
+        the page, the first time one is needed.
+    """
+
+    def __init__(self, soup, href, city, numReviews=None, state=''):
+        self.soup = soup
+        self.href = href
+        self.city = city
+        self.state = state
+        self.numReviews = numReviews
+        self._index = None
+
+    def first(self, key):
+        """ :returns: the first node matching the target key, or None """
+        if self._index is None:
+            self._index = index_page(self.soup)
+        return self._index.get(key)
+
+    @property
+    def api_listing_id(self):
+        """ The "vrbo-XXXXXX-XXXXXXX' or 'trips-XXXXXX-XXXXXXX' id used for
+            the ajax calls, or None if the page didn't fully load
+        """
+        button = self.first('favorite_button')
+        return button.get('data-spu') if button is not None else None
+
+
+# field name -> extractor, in the order the fields were originally scraped
+LISTING_EXTRACTORS = collections.OrderedDict()
+
+
+def extractor(*attrs):
+    """ Registers the decorated function as the extractor for attrs """
+    def register(func):
+        for attr in attrs:
+            LISTING_EXTRACTORS[attr] = func
+        return func
+    return register
+
+
+def extract_listing(page, timings=None):
+    """ Runs every extractor over the page. Fields that can't be found are
+        logged and left blank. If timings is given, the seconds each field
+        took are put in it.
+        :returns: a row for the listing csv
+    """
+    row = {}
+    for attr, extract in LISTING_EXTRACTORS.items():
+        start = time.perf_counter()
+        try:
+            row[attr] = extract(page)
+        except Exception:
+            logging.error("Could not retrieve %s attribute!!", attr)
+            row[attr] = ''
+        if timings is not None:
+            timings[attr] = time.perf_counter() - start
+    return row
+
+
+def labelled_value(page, key):
+    """ Returns the sibling after the element holding the label string """
+    return page.first(key).parent.next_sibling
+
+
+def strong_after(page, key):
+    """ Returns the text of the <strong> next to the label string """
+    return page.first(key).parent.find('strong').text
+
+
+def fee(page, pattern, value_re=DIGITS_RE):
+    """ Returns the amount of a fee from the additional info section """
+    label = page.first('additional_info').find(string=pattern)
+    return value_re.search(label.parent.next_sibling.next_sibling.text).group()
+
+
+@extractor('listing_id')
+def listing_id(page):
+    return page.href[1:]
+
+
+@extractor('listing_title')
+def listing_title(page):
+    return page.first('listing_title').text.strip()
+
+
+@extractor('latitude')
+def latitude(page):
+    return float(page.first('latitude')['content'])
+
+
+@extractor('longitude')
+def longitude(page):
+    return float(page.first('longitude')['content'])
+
+
+@extractor('location_name')
+def location_name(page):
+    return page.first('location_name').text.strip()
+
+
+@extractor('number_reviews')
+def number_reviews(page):
+    return page.numReviews
+
+
+@extractor('average_rating')
+def average_rating(page):
+    return float(DECIMAL_RE.search(page.first('rating')['title']).group(0))
+
+
+@extractor('average_nightly_price')
+def average_nightly_price(page):
+    return int(page.first('price').text.strip()[1:])
+
+
+@extractor('min_stay')
+def min_stay(page):
+    return int(DIGITS_RE.search(labelled_value(page, 'min_stay').next_sibling.text).group())
+
+
+@extractor('sleeps')
+def sleeps(page):
+    return int(labelled_value(page, 'sleeps').text)
+
+
+@extractor('bedrooms')
+def bedrooms(page):
+    return labelled_value(page, 'bedrooms').next_sibling.text
+
+
+@extractor('bathrooms')
+def bathrooms(page):
+    return int(labelled_value(page, 'bathrooms').text)
+
+
+@extractor('property_type')
+def property_type(page):
+    return page.first('property_type').next_sibling.next_sibling.find('li').text.strip()
+
+
+@extractor('internet')
+def internet(page):
+    return 'Yes' if page.first('internet') else 'No'
+
+
+@extractor('member_since')
+def member_since(page):
+    return FIRST_NUMBER_RE.search(page.first('advertiser_date').text.strip()).group(1)
+
+
+@extractor('response_time')
+def response_time(page):
+    return strong_after(page, 'response_time')
+
+
+@extractor('response_rate')
+def response_rate(page):
+    return strong_after(page, 'response_rate')
+
+
+@extractor('calendar_last_updated')
+def calendar_last_updated(page):
+    return strong_after(page, 'calendar_last_updated')
+
+
+@extractor('type')
+def type_(page):
+    return property_type(page)
+
+
+@extractor('floor')
+def floor(page):
+    floorList = page.first('property_type').next_sibling.next_sibling.next_sibling.next_sibling
+    return FIRST_NUMBER_RE.search(floorList.find('li').text).group(1)
+
+
+@extractor('sq_footage')
+def sq_footage(page):
+    area = page.first('floor_area').next_sibling.next_sibling
+    return DIGITS_RE.search(area.find('li').text).group(0)
+
+
+@extractor('max_occupancy')
+def max_occupancy(page):
+    return int(page.first('max_occupancy').parent.find('span').text.strip())
+
+
+@extractor('building_type')
+def building_type(page):
+    return page.first('building_type').next_sibling.next_sibling.find('li').text.strip()
+
+
+def standard_rate(page, column):
+    row = page.first('standard_rate_title').parent.parent
+    return DIGITS_RE.search(row.find('td', class_=column).find(class_='rate').text).group()
+
+
+@extractor('nightly')
+def nightly(page):
+    return standard_rate(page, 'nightly')
+
+
+@extractor('weekend_night')
+def weekend_night(page):
+    return standard_rate(page, 'weekendNight')
+
+
+@extractor('property_protection_fee')
+def property_protection_fee(page):
+    return fee(page, PROPERTY_PROTECTION_RE)
+
+
+@extractor('cleaning_fee')
+def cleaning_fee(page):
+    return fee(page, CLEANING_FEE_RE)
+
+
+@extractor('tax_rate')
+def tax_rate(page):
+    return fee(page, TAX_RATE_RE, PERCENT_RE)
+
+
+@extractor('city')
+def city(page):
+    return page.city
+
+
+@extractor('state')
+def state(page):
+    return page.state
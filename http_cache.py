@@ -0,0 +1,223 @@
+""" An on-disk cache of the responses the scraper fetches, so reruns don't
+    download pages again and extraction can be replayed without the network.
+
+    Response bodies are stored compressed under objects/, named by the hash
+    of their contents, so identical bodies are only stored once. An sqlite
+    index maps each url (with its params) to its body, when it expires and
+    when it was last used. Once the bodies go over the size limit the least
+    recently used responses are evicted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+
+class CacheMiss(Exception):
+    """ Raised when replaying from the cache and a url was never cached """
+
+
+class ResponseCache:
+
+    DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+    DEFAULT_TTL = 7 * 24 * 60 * 60
+    # check the size limit every this many puts, rather than on every one
+    EVICT_EVERY = 100
+    # these described the body as it came over the wire, not as we store it
+    DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        # the fetches in async mode come from several threads
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                  timeout=60, check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                   key TEXT PRIMARY KEY,
+                                   url TEXT,
+                                   body TEXT,
+                                   size INTEGER,
+                                   status INTEGER,
+                                   encoding TEXT,
+                                   headers TEXT,
+                                   expires REAL,
+                                   last_used REAL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            # eviction looks up whether anything still points to a body
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_body ON responses (body)")
+
+    @staticmethod
+    def get_full_url(url, params=None):
+        """ :returns: url with params encoded the way requests sends them """
+        return requests.Request('GET', url, params=params).prepare().url
+
+    @staticmethod
+    def get_key(fullUrl):
+        return hashlib.sha256(fullUrl.encode('utf-8')).hexdigest()
+
+    def get_body_path(self, bodyHash):
+        return os.path.join(self.directory, 'objects', bodyHash[:2], bodyHash + '.z')
+
+    def get(self, url, params=None, allow_expired=False):
+        """ :returns: the cached response for url and params, or None if it
+                      isn't cached or has expired
+        """
+        fullUrl = self.get_full_url(url, params)
+        key = self.get_key(fullUrl)
+        now = time.time()
+        with self.lock:
+            entry = self.db.execute("SELECT body, status, encoding, headers, expires "
+                                    "FROM responses WHERE key = ?", (key,)).fetchone()
+            if entry is None or (entry[4] < now and not allow_expired):
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+
+        bodyHash, status, encoding, headers, _ = entry
+        try:
+            with open(self.get_body_path(bodyHash), 'rb') as bodyFile:
+                body = zlib.decompress(bodyFile.read())
+        except (OSError, zlib.error):
+            # left for the next put to replace, since replaying mustn't
+            # change the cache
+            logging.error("Cached body for %s is missing or corrupt", fullUrl)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        resp = requests.models.Response()
+        resp._content = body
+        resp.status_code = status
+        resp.encoding = encoding
+        resp.url = fullUrl
+        resp.headers = requests.structures.CaseInsensitiveDict(json.loads(headers))
+        return resp
+
+    def put(self, url, params, resp):
+        """ Caches resp as the response for url and params """
+        fullUrl = self.get_full_url(url, params)
+        body = resp.content
+        bodyHash = hashlib.sha256(body).hexdigest()
+        path = self.get_body_path(bodyHash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so a crash can't leave half a body behind
+            tmpPath = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+            with open(tmpPath, 'wb') as bodyFile:
+                bodyFile.write(zlib.compress(body))
+            os.replace(tmpPath, path)
+
+        headers = { name: value for name, value in resp.headers.items()
+                    if name.lower() not in self.DROPPED_HEADERS }
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (self.get_key(fullUrl), fullUrl, bodyHash, os.path.getsize(path),
+                             resp.status_code, resp.encoding, json.dumps(headers),
+                             now + self.ttl, now))
+            self.puts_since_evict += 1
+            if self.puts_since_evict >= self.EVICT_EVERY:
+                self.puts_since_evict = 0
+                self.evict()
+
+    def discard(self, url, params=None):
+        """ Drops the cached response for url and params, if there is one """
+        key = self.get_key(self.get_full_url(url, params))
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self):
+        """ Drops the least recently used responses until the stored bodies
+            fit in max_bytes. Must be called holding the lock.
+        """
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                                "(SELECT DISTINCT body, size FROM responses)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, bodyHash in self.db.execute("SELECT key, body FROM responses "
+                                             "ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            evicted += 1
+            # bodies can be shared, so only delete ones nothing points to now
+            if self.db.execute("SELECT 1 FROM responses WHERE body = ? LIMIT 1",
+                               (bodyHash,)).fetchone() is None:
+                path = self.get_body_path(bodyHash)
+                try:
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    pass
+        logging.info("Evicted %d responses from the cache", evicted)
+
+    def close(self):
+        self.db.close()
+
+
+class ValidatorStore:
+    """ The ETag and Last-Modified the site sent with each page, so the next
+        crawl can ask for the page only if it's changed, and whatever the
+        caller needs to carry on without the page when it hasn't.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # the workers scraping other cities use the same store
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS validators (
+                                   url TEXT PRIMARY KEY,
+                                   etag TEXT,
+                                   last_modified TEXT,
+                                   data TEXT)""")
+
+    def get(self, url):
+        """ :returns: the headers to make a request for url conditional, and
+                      the data saved with them, or None if there's nothing
+                      stored for url
+        """
+        with self.lock:
+            entry = self.db.execute("SELECT etag, last_modified, data FROM validators "
+                                    "WHERE url = ?", (url,)).fetchone()
+        if entry is None:
+            return None
+        etag, lastModified, data = entry
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if lastModified:
+            headers['If-Modified-Since'] = lastModified
+        return headers, json.loads(data)
+
+    def put(self, url, resp, data):
+        """ Stores the validators resp came with, if it had any """
+        etag = resp.headers.get('ETag')
+        lastModified = resp.headers.get('Last-Modified')
+        if not etag and not lastModified:
+            return
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)",
+                            (url, etag, lastModified, json.dumps(data)))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,51 @@
+""" What we already have for each listing of a city, so a refresh crawl can
+    skip listings that haven't changed and only add the new reviews of the
+    ones that have.
+"""
+
+import logging
+
+
+class KnownListing:
+    """ The last row written for a listing and the newest of its reviews """
+
+    def __init__(self, calendarLastUpdated='', numberReviews=''):
+        self.calendar_last_updated = calendarLastUpdated
+        self.number_reviews = numberReviews
+        self.latest_submitted = ''
+        self.last_n_review = 0
+
+    def is_unchanged(self, row):
+        """ Whether a freshly scraped row for the listing matches what we
+            have. Everything read back from the csv is a string.
+        """
+        return (str(row['calendar_last_updated']) == self.calendar_last_updated and
+                str(row['number_reviews']) == self.number_reviews)
+
+    def is_new_review(self, review):
+        # the dates are all ISO 8601 in the same timezone, so they sort as
+        # strings
+        return review['submitted'] > self.latest_submitted
+
+
+def load_city_index(listingRows, reviewRows):
+    """ Reads the listing and review rows already written for a city, as
+        the strings a csv gives back
+        :returns: listing_id -> KnownListing
+    """
+    index = {}
+    for row in listingRows:
+        # later rows are from later crawls
+        index[row['listing_id']] = KnownListing(row['calendar_last_updated'],
+                                                row['number_reviews'])
+    for row in reviewRows:
+        known = index.get(row['listing_id'])
+        if known is None:
+            continue
+        known.latest_submitted = max(known.latest_submitted, row['submitted'])
+        try:
+            known.last_n_review = max(known.last_n_review, int(row['n_review']))
+        except ValueError:
+            pass
+    logging.info("Already have %d listings", len(index))
+    return index
@@ -0,0 +1,150 @@
+""" Where the scraper's log goes. Records are put on a queue by whatever
+    logs them, and a listener thread formats them and writes them to the
+    console and the log file, so the scrape never waits on either. The
+    parser processes of pipeline mode log through the queue too, once
+    log_to_queue has been run in them; a process that's spawned rather
+    than forked starts without any handlers.
+
+    The log files of the last few runs are kept, the last one rotated to
+    <log file>.1 and so on when a run starts. The log file can be written as
+    a json object per line, with the message before its arguments were put
+    in as the event, so records of the same kind can be picked out.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import time
+
+
+DEFAULT_BACKUPS = 5
+FILE_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+FILE_DATE_FORMAT = '%m-%d %H:%M'
+CONSOLE_FORMAT = '%(name)-12s: %(levelname)-8s %(message)s'
+
+# the listener started by start_logging, and the handler feeding it
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as a line of json """
+
+    def format(self, record):
+        entry = {'time': '{}.{:03d}'.format(
+                         time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                         int(record.msecs)),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'process': record.process,
+                 'thread': record.threadName,
+                 'event': getattr(record, 'event', record.msg),
+                 'message': record.getMessage()}
+        return json.dumps(entry)
+
+
+class EventQueueHandler(logging.handlers.QueueHandler):
+    """ Puts the message, and any traceback, into a record before it's
+        queued, like QueueHandler does, but keeps the message it started as
+        for the json log. Nothing else handles the record, so it's changed
+        rather than copied first.
+    """
+
+    def prepare(self, record):
+        record.event = str(record.msg)
+        record.msg = record.message = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+
+def open_log_file(logFile, backups):
+    """ Rotates the log of the last run out of the way
+        :returns: a handler writing to logFile
+    """
+    if not backups:
+        return logging.FileHandler(logFile, mode='w')
+    handler = logging.handlers.RotatingFileHandler(logFile, backupCount=backups, delay=True)
+    if os.path.exists(logFile) and os.path.getsize(logFile):
+        handler.doRollover()
+    return handler
+
+def start_logging(logFile, structured=False, backups=DEFAULT_BACKUPS):
+    """ Sends everything logged at INFO or above to logFile and the console,
+        through a queue. Any logging started before is stopped first.
+        :returns: the console handler, so it can be quietened
+    """
+    global _listener, _queue_handler
+    stop_logging()
+    fileHandler = open_log_file(logFile, backups)
+    if structured:
+        fileHandler.setFormatter(JsonFormatter())
+    else:
+        fileHandler.setFormatter(logging.Formatter(FILE_FORMAT, FILE_DATE_FORMAT))
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    # nothing logged says where it was logged from or the name of its
+    # process, so don't spend time finding them out for every record
+    logging._srcfile = None
+    logging.logMultiprocessing = False
+
+    # a multiprocessing queue, so the processes forked off this one log
+    # through it too
+    queue = multiprocessing.Queue(-1)
+    _queue_handler = EventQueueHandler(queue)
+    root = logging.getLogger('')
+    root.setLevel(logging.INFO)
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(queue, fileHandler, console,
+                                               respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    # suppress requests and urllib3 logging messages
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    return console
+
+def get_log_queue():
+    """ :returns: the queue start_logging sends records through, or None if
+                  logging wasn't started
+    """
+    if _queue_handler is None:
+        return None
+    return _queue_handler.queue
+
+def log_to_queue(queue):
+    """ Sends what this process logs through queue, which get_log_queue gave
+        the process that started logging. Meant to be the initializer of a
+        pool of worker processes. Does nothing if queue is None.
+    """
+    if queue is None:
+        return
+    root = logging.getLogger('')
+    # a forked process has the handler it was forked with already
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    logging._srcfile = None
+    logging.logMultiprocessing = False
+    root.setLevel(logging.INFO)
+    root.addHandler(EventQueueHandler(queue))
+
+def stop_logging():
+    """ Writes out whatever is still queued and closes the log file. Worker
+        processes have to call this themselves, since they exit without
+        running atexit.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger('').removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _queue_handler = None
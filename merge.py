@@ -0,0 +1,207 @@
+#! /usr/bin/env python3.5
+""" Merges the listing and review files of every city directory into a
+    master file of each, checking every file has the columns the scraper
+    writes and dropping rows that were written more than once.
+
+    The city files are hashed in a pool of processes, a few at a time, and
+    read again a row at a time as they're written out in order, so the rows
+    themselves are never all in memory. What is kept is 8 bytes for each
+    row of the files in flight, and 8 bytes for each row written, in a
+    HashSet, to spot duplicates.
+
+    usage: merge.py [--output csv|parquet] [--workers N] [directory]
+"""
+
+import argparse
+import array
+import bisect
+import collections
+import csv
+import glob
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from scraper import CityScrape
+from sinks import SINKS
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# kind -> (fieldnames, columns a row is a duplicate by, or None for the
+# whole row, since a listing that changed is written again on a refresh)
+KINDS = collections.OrderedDict([
+    ('listing', (CityScrape.LISTING_FIELDNAMES, None)),
+    ('review', (CityScrape.REVIEW_FIELDNAMES, ('listing_id', 'n_review'))),
+])
+# rows read from a parquet file at a time
+PARQUET_BATCH_ROWS = 10000
+
+
+class HashSet:
+    """ A set of 64 bit hashes at 8 bytes a hash, where a set of ints takes
+        60 or so. The hashes are kept in sorted arrays, picked by their top
+        BUCKET_BITS bits, so each array stays small enough to insert into
+        quickly.
+    """
+
+    BUCKET_BITS = 16
+
+    def __init__(self):
+        self.buckets = [None] * (1 << self.BUCKET_BITS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, value):
+        bucket = self.buckets[value >> (64 - self.BUCKET_BITS)]
+        if bucket is None:
+            return False
+        i = bisect.bisect_left(bucket, value)
+        return i < len(bucket) and bucket[i] == value
+
+    def add(self, value):
+        """ :returns: whether value wasn't in the set already """
+        bucketNum = value >> (64 - self.BUCKET_BITS)
+        bucket = self.buckets[bucketNum]
+        if bucket is None:
+            bucket = self.buckets[bucketNum] = array.array('Q')
+        i = bisect.bisect_left(bucket, value)
+        if i < len(bucket) and bucket[i] == value:
+            return False
+        bucket.insert(i, value)
+        self.size += 1
+        return True
+
+
+def find_city_files(directory, kind):
+    """ :returns: the csvs and parquet directories of kind in each city
+                  directory, in order
+    """
+    paths = []
+    for extension in ('.csv', '.parquet'):
+        paths += glob.glob(os.path.join(directory, '*', '*_{}{}'.format(kind, extension)))
+    return sorted(paths)
+
+def get_part_paths(path):
+    """ :returns: the part files of a parquet directory, in order """
+    if pyarrow is None:
+        raise ImportError("Reading parquet needs pyarrow installed")
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+def read_columns(path):
+    """ :returns: the columns of a city file """
+    if path.endswith('.csv'):
+        with open(path, newline='') as cityFile:
+            return next(csv.reader(cityFile), [])
+    partPaths = get_part_paths(path)
+    return pyarrow.parquet.read_schema(partPaths[0]).names if partPaths else []
+
+def iter_rows(path):
+    """ Yields the rows of a city file as lists of strings, like a csv gives
+        them, reading a parquet file a batch at a time
+    """
+    if path.endswith('.csv'):
+        with open(path, newline='') as cityFile:
+            rows = csv.reader(cityFile)
+            next(rows, None)
+            yield from rows
+        return
+    for partPath in get_part_paths(path):
+        for batch in pyarrow.parquet.ParquetFile(partPath).iter_batches(batch_size=PARQUET_BATCH_ROWS):
+            for row in batch.to_pylist():
+                yield [ '' if value is None else str(value) for value in row.values() ]
+
+def get_row_hash(values):
+    """ :returns: a 64 bit hash of values, which is all that's kept of a row
+                  to spot it again
+    """
+    digest = hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def hash_city_file(path, kind):
+    """ Hashes the rows of one city file in a worker process
+        :returns: an array of the hash of each row's key, or None if the
+                  file doesn't have the columns it should
+    """
+    fieldnames, keyColumns = KINDS[kind]
+    columns = read_columns(path)
+    if columns != fieldnames:
+        logging.error("%s has the columns %s, not %s", path, columns, fieldnames)
+        return None
+
+    keyIndexes = [ fieldnames.index(name) for name in keyColumns ] if keyColumns else None
+    return array.array('Q', (get_row_hash([ row[i] for i in keyIndexes ] if keyIndexes else row)
+                             for row in iter_rows(path)))
+
+def open_master(directory, kind, output):
+    """ :returns: a sink for the master file of kind, replacing any old one """
+    sinkClass = SINKS[output]
+    path = os.path.join(directory, 'master_{}s{}'.format(kind, sinkClass.EXTENSION))
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    return sinkClass(path, KINDS[kind][0])
+
+def write_city_file(master, path, kind, hashes, seen):
+    """ Writes the rows of a city file that haven't been seen before
+        :returns: how many rows were written
+    """
+    if hashes is None:
+        logging.error("Skipped %s", path)
+        return 0
+    fieldnames = KINDS[kind][0]
+    written = 0
+    for row, rowHash in zip(iter_rows(path), hashes):
+        if seen.add(rowHash):
+            master.writerow(dict(zip(fieldnames, row)))
+            written += 1
+    # each city ends up in its own part of a parquet master
+    master.sync()
+    logging.info("%s: %d of %d rows", path, written, len(hashes))
+    return written
+
+def merge(directory, kind, output, workers=None):
+    """ Merges the city files of kind into its master file """
+    workers = workers or os.cpu_count()
+    paths = find_city_files(directory, kind)
+    master = open_master(directory, kind, output)
+    seen = HashSet()
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a few files ahead of the one being written, but only a few
+        pending = collections.deque()
+        for path in paths:
+            pending.append((path, executor.submit(hash_city_file, path, kind)))
+            if len(pending) >= 2 * workers:
+                path_, future = pending.popleft()
+                total += write_city_file(master, path_, kind, future.result(), seen)
+        while pending:
+            path_, future = pending.popleft()
+            total += write_city_file(master, path_, kind, future.result(), seen)
+    master.close()
+    logging.info("Wrote %d %s rows from %d files to %s", total, kind, len(paths), master.path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default='.',
+                        help="directory holding the city directories")
+    parser.add_argument('--output', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes to read city files in (defaults to "
+                             "the number of cpus)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s %(message)s')
+    for kind in KINDS:
+        merge(args.directory, kind, args.output, args.workers)
+
+if __name__ == "__main__":
+    main()
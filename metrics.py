@@ -0,0 +1,164 @@
+""" Where the time goes while scraping a city. Each stage (fetching, parsing,
+    extracting each field, writing) records how long it took into a
+    histogram, along with counters like bytes downloaded and retries. A
+    summary is logged every so often, and the whole lot is dumped as json
+    when the city is done.
+
+    Also holds the hook for running the scrape under a profiler.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import math
+import threading
+import time
+
+
+class Histogram:
+    """ Latencies counted in buckets that double in size from a millisecond,
+        so it stays small however many are added
+    """
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.buckets[0 if ms <= 1 else math.ceil(math.log2(ms))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """ :returns: the upper bound in seconds of the bucket the latency
+                      fraction of the way through falls in
+        """
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min(2 ** bucket / 1000, self.max)
+        return 0.0
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total_seconds': self.total,
+                'mean_seconds': self.total / self.count if self.count else 0.0,
+                'max_seconds': self.max,
+                'p50_seconds': self.percentile(0.5),
+                'p90_seconds': self.percentile(0.9),
+                'p99_seconds': self.percentile(0.99),
+                'buckets_ms': { str(2 ** bucket): count
+                                for bucket, count in sorted(self.buckets.items()) }}
+
+
+class Metrics:
+
+    DEFAULT_SUMMARY_SECONDS = 60
+    # stages shown in the summary line, the rest are only in the json
+    SUMMARY_STAGES = ['network', 'parse', 'extract', 'write', 'checkpoint']
+
+    def __init__(self, summary_seconds=DEFAULT_SUMMARY_SECONDS):
+        self.summary_seconds = summary_seconds
+        # the fetches in async mode record from several threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Starts over, for the next city """
+        with self.lock:
+            self.started = time.monotonic()
+            self.last_summary = self.started
+            self.stages = collections.defaultdict(Histogram)
+            self.counters = collections.Counter()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.stages[stage].add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """ Records how long the with block takes as stage """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def get_listings_per_minute(self):
+        elapsed = time.monotonic() - self.started
+        return 60 * self.counters['listings'] / elapsed if elapsed else 0.0
+
+    def to_dict(self):
+        with self.lock:
+            return {'elapsed_seconds': time.monotonic() - self.started,
+                    'listings_per_minute': self.get_listings_per_minute(),
+                    'counters': dict(self.counters),
+                    'stages': { stage: histogram.to_dict()
+                                for stage, histogram in sorted(self.stages.items()) }}
+
+    def summary(self):
+        """ :returns: a line with the rate, bytes, retries and the mean and
+                      p90 of the main stages
+        """
+        with self.lock:
+            parts = ["{} listings ({:.1f}/min), {:.1f} MB, {} retries".format(
+                    self.counters['listings'], self.get_listings_per_minute(),
+                    self.counters['bytes'] / 1024 ** 2, self.counters['retries'])]
+            for stage in self.SUMMARY_STAGES:
+                histogram = self.stages.get(stage)
+                if histogram is not None and histogram.count:
+                    parts.append("{} {:.1f}/{:.1f} ms".format(
+                            stage, 1000 * histogram.total / histogram.count,
+                            1000 * histogram.percentile(0.9)))
+        return ', '.join(parts) + " (mean/p90)"
+
+    def maybe_log_summary(self):
+        """ Logs the summary if it's been summary_seconds since the last one """
+        now = time.monotonic()
+        if now - self.last_summary >= self.summary_seconds:
+            self.last_summary = now
+            logging.info(self.summary())
+
+    def dump(self, path):
+        with open(path, 'w') as metricsFile:
+            json.dump(self.to_dict(), metricsFile, indent=2, sort_keys=True)
+
+
+def run_profiled(func, profiler, output):
+    """ Runs func under profiler ('cprofile' or 'pyinstrument', or None to
+        not profile) and saves what it found to output. cProfile only sees
+        the thread func runs in, so in async mode pyinstrument shows more.
+        :returns: what func returned
+    """
+    if profiler is None:
+        return func()
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            return func()
+        finally:
+            profile.stop()
+            with open(output, 'w') as outputFile:
+                outputFile.write(profile.output_html())
+            logging.info("Saved the profile to %s", output)
+
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func)
+    finally:
+        profile.dump_stats(output)
+        logging.info("Saved the profile to %s, see it with python -m pstats %s",
+                     output, output)
@@ -0,0 +1,236 @@
+#! /usr/bin/env python3.5
+""" A local stand-in for vrbo.com that serves a corpus of recorded pages, so
+    the scraper can be run end to end without the network. It can be made
+    slow, and made to fail some requests with 429s and 503s, to see how the
+    scraper copes.
+
+    A corpus is a directory with an index.json mapping the path and query
+    of each request to the file holding its body. Responses have an ETag,
+    and requests with a matching If-None-Match get a 304. A page of reviews
+    of a size that wasn't recorded is cut out of the pages that were, so
+    the refresh modes, which ask for a single review to count them, and
+    --review-page-size can be run against a corpus recorded by a plain
+    scrape. Record a corpus by
+    scraping with --cache-dir and exporting the cache:
+
+        mock_vrbo.py export <cache dir> <corpus dir> 'City, ST' ...
+        mock_vrbo.py serve <corpus dir> [--port 8000] [--latency 0.05]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+REVIEW_PATH = '/ajax/review/'
+
+
+def get_request_key(url):
+    """ :returns: the path and query of url, with the params sorted so the
+                  order they're sent in doesn't matter
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query)))
+    return parts.path + ('?' + query if query else '')
+
+def split_request_key(key):
+    """ :returns: the path of key, and its params as a dict """
+    path, _, query = key.partition('?')
+    return path, dict(parse_qsl(query))
+
+
+class Corpus:
+    """ The recorded responses, by request key """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as indexFile:
+            index = json.load(indexFile)
+        self.cities = [ tuple(cityState) for cityState in index['cities'] ]
+        self.responses = index['responses']
+        # the recorded pages of each listing's reviews, as (page size, page
+        # number, key)s by path
+        self.review_pages = {}
+        for key in self.responses:
+            path, params = split_request_key(key)
+            if path.startswith(REVIEW_PATH) and 'pageNum' in params and 'pageSize' in params:
+                self.review_pages.setdefault(path, []).append(
+                        (int(params['pageSize']), int(params['pageNum']), key))
+
+    def get(self, key):
+        """ :returns: the body and content type recorded for key, or None """
+        entry = self.responses.get(key)
+        if entry is None:
+            return self.get_review_page(key)
+        return self.read_body(entry), entry['content_type']
+
+    def read_body(self, entry):
+        with open(os.path.join(self.directory, entry['file']), 'rb') as bodyFile:
+            return bodyFile.read()
+
+    def get_review_page(self, key):
+        """ Cuts the page of reviews key asks for out of the pages recorded
+            for its listing, at whatever size they were recorded
+            :returns: the body and content type of the page, or None if
+                      the reviews it holds weren't recorded
+        """
+        path, params = split_request_key(key)
+        try:
+            pageNum = int(params['pageNum'])
+            pageSize = int(params['pageSize'])
+        except (KeyError, ValueError):
+            return None
+        if path not in self.review_pages or pageNum < 1 or pageSize < 1:
+            return None
+        # the biggest pages need the fewest reads
+        recordedSize = max(size for size, _, _ in self.review_pages[path])
+        pages = sorted((num, key) for size, num, key in self.review_pages[path]
+                       if size == recordedSize)
+
+        start = (pageNum - 1) * pageSize
+        end = start + pageSize
+        reviews = []
+        firstPage = None
+        contentType = None
+        for expectedNum, (num, recordedKey) in enumerate(pages, 1):
+            # only the reviews of pages recorded one after the other from the
+            # first are known to be where they'd be
+            if num != expectedNum or len(reviews) >= end:
+                break
+            entry = self.responses[recordedKey]
+            page = json.loads(self.read_body(entry).decode('utf-8'))
+            if firstPage is None:
+                firstPage = page
+                contentType = entry['content_type']
+            reviews.extend(page['list'])
+        totalResults = firstPage['pagingContext']['totalResults']
+        if len(reviews) < min(end, totalResults):
+            return None
+        body = dict(firstPage, list=reviews[start:end])
+        return json.dumps(body).encode('utf-8'), contentType
+
+
+class MockVrboHandler(BaseHTTPRequestHandler):
+
+    # set on the subclass made for each server
+    corpus = None
+    latency = 0.0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            if random.random() < 0.5:
+                self.send_error_response(429, {'Retry-After': '1'})
+            else:
+                self.send_error_response(503)
+            return
+
+        found = self.corpus.get(get_request_key(self.path))
+        if found is None:
+            logging.error("Nothing recorded for %s", self.path)
+            self.send_error_response(404)
+            return
+        body, contentType = found
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            self.send_error_response(304, {'ETag': etag})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_response(self, status, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def start_server(corpus, port=0, latency=0.0, error_rate=0.0):
+    """ Serves corpus on a background thread
+        :returns: the server, and the base url to point the scraper at
+    """
+    handler = type('Handler', (MockVrboHandler,),
+                   {'corpus': corpus, 'latency': latency, 'error_rate': error_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def export_cache(cacheDir, corpusDir, cities):
+    """ Writes the responses of a ResponseCache directory out as a corpus """
+    os.makedirs(os.path.join(corpusDir, 'bodies'), exist_ok=True)
+    db = sqlite3.connect(os.path.join(cacheDir, 'index.sqlite'))
+    responses = {}
+    for url, bodyHash, headers in db.execute("SELECT url, body, headers FROM responses "
+                                             "WHERE status = 200 ORDER BY url"):
+        with open(os.path.join(cacheDir, 'objects', bodyHash[:2], bodyHash + '.z'), 'rb') as bodyFile:
+            body = zlib.decompress(bodyFile.read())
+        contentType = json.loads(headers).get('Content-Type', 'text/html')
+        key = get_request_key(url)
+        extension = '.json' if 'json' in contentType else '.html'
+        name = 'bodies/' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + extension
+        with open(os.path.join(corpusDir, name), 'wb') as bodyFile:
+            bodyFile.write(body)
+        responses[key] = {'file': name, 'content_type': contentType}
+    db.close()
+    with open(os.path.join(corpusDir, 'index.json'), 'w') as indexFile:
+        json.dump({'cities': cities, 'responses': responses}, indexFile,
+                  indent=1, sort_keys=True)
+    logging.info("Exported %d responses to %s", len(responses), corpusDir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    serve = commands.add_parser('serve', help="serve a corpus")
+    serve.add_argument('corpus')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--latency', type=float, default=0.0,
+                       help="seconds to wait before every response")
+    serve.add_argument('--error-rate', type=float, default=0.0,
+                       help="fraction of requests to answer with a 429 or 503")
+    export = commands.add_parser('export', help="make a corpus from a --cache-dir")
+    export.add_argument('cache_dir')
+    export.add_argument('corpus')
+    export.add_argument('cities', nargs='+', help="the 'City, ST's the cache has")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s %(message)s')
+
+    if args.command == 'export':
+        cities = [ [ part.strip() for part in city.rsplit(',', 1) ] for city in args.cities ]
+        export_cache(args.cache_dir, args.corpus, cities)
+        return
+
+    server, baseUrl = start_server(Corpus(args.corpus), args.port, args.latency,
+                                   args.error_rate)
+    logging.info("Serving %s at %s", args.corpus, baseUrl)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
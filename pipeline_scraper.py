@@ -0,0 +1,107 @@
+#! /usr/bin/env python3.5
+
+import asyncio
+import logging
+import os
+import time
+from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+
+from async_scraper import AsyncCityScrape
+from extractors import ListingPage, extract_listing
+from log_config import get_log_queue, log_to_queue
+
+
+def parse_listing(html, encoding, href, city, state, parser):
+    """ Parses a listing page in a parser worker process
+        :returns: the api listing id (None if the page wasn't fully loaded),
+                  the listing data, missing number_reviews, the seconds the
+                  parse took and the seconds each field took to extract
+    """
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, parser, from_encoding=encoding)
+    parseTime = time.perf_counter() - start
+    page = ListingPage(soup, href, city, state=state)
+    if page.api_listing_id is None:
+        return None, None, parseTime, {}
+    timings = {}
+    return page.api_listing_id, extract_listing(page, timings), parseTime, timings
+
+
+class PipelineCityScrape(AsyncCityScrape):
+    """ Fetches listings concurrently like AsyncCityScrape, but hands the
+        raw listing pages to a pool of parser processes, so parsing doesn't
+        hold up the threads waiting on the network.
+    """
+
+    def __init__(self, max_in_flight=8, pool_size=None, parser=None,
+                 parse_workers=None, parse_queue_size=None, **kwargs):
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        # how many fetched pages can be waiting for a parser before the
+        # fetchers stop fetching listing pages
+        self.parse_queue_size = parse_queue_size or 2 * self.parse_workers
+        super().__init__(max_in_flight=max_in_flight, pool_size=pool_size,
+                         parser=parser, **kwargs)
+
+    async def fetch_all_listing_data_for_city(self, loop, executor, listingHrefs,
+                                              morePages=None, seen=None):
+        self.parse_slots = asyncio.Semaphore(self.parse_queue_size)
+        with ProcessPoolExecutor(max_workers=self.parse_workers, initializer=log_to_queue,
+                                 initargs=(get_log_queue(),)) as parsePool:
+            self.parse_pool = parsePool
+            await super().fetch_all_listing_data_for_city(loop, executor, listingHrefs,
+                                                          morePages, seen)
+
+    def fetch_listing(self, loop, executor, href):
+        if self.reviews_only:
+            # there are no listing pages to parse
+            return super().fetch_listing(loop, executor, href)
+        return asyncio.ensure_future(self.fetch_and_parse_listing(loop, executor, href))
+
+    async def fetch_and_parse_listing(self, loop, executor, href):
+        """ Same as CityScrape.get_data_for_listing, but with the listing
+            page parsed in the parser pool
+            :returns: listing data to be saved to csv or txt file, and the
+                      review rows for the listing
+        """
+        logging.info("Getting data for %s%s", self.get_base_url(), href)
+        reused = await loop.run_in_executor(executor, self.reuse_seen_listing, href)
+        if reused is not None:
+            return reused
+        saved = self.get_saved_validators(href)
+        attempt = 0
+        while True:
+            # waits here while the parsers are behind, so we don't keep
+            # piling up fetched pages
+            await self.parse_slots.acquire()
+            try:
+                resp = await loop.run_in_executor(executor, self.request_listing_page,
+                                                  href, saved)
+                if resp.status_code != 304:
+                    apiListingID, row, parseTime, timings = await loop.run_in_executor(
+                            self.parse_pool, parse_listing, resp.content,
+                            resp.encoding, href, self.cur_city, self.cur_state,
+                            self.parser)
+            finally:
+                self.parse_slots.release()
+            if resp.status_code == 304:
+                return await loop.run_in_executor(executor, self.reuse_unmodified_listing,
+                                                  href, saved)
+            self.metrics.observe('parse', parseTime)
+            self.record_extract_timings(timings)
+            if apiListingID is not None:
+                break
+            # replaying would only get the same page from the cache again
+            if self.replay or attempt + 1 >= self.retry_policy.max_attempts:
+                logging.error("Giving up on %s, it never fully loaded", href)
+                return None, []
+            logging.error("Failed to find the api-id information for a listing. Probably didn't have enough time for page to load. Retrying...")
+            await asyncio.sleep(self.retry_policy.get_delay(attempt))
+            attempt += 1
+            self.discard_cached(self.get_base_url() + href)
+            # only the first fetch can be conditional
+            saved = None
+
+        self.save_validators(href, resp, apiListingID, row)
+        return await loop.run_in_executor(executor, self.get_all_reviews_from_listing,
+                                          apiListingID, href, row)
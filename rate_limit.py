@@ -0,0 +1,102 @@
+""" Keeps the scraper going as fast as the site will let it. Requests wait
+    on a token bucket whose rate goes up a little with every healthy
+    response and is cut in half whenever the site pushes back (429s, 5xxs
+    and timeouts), the same way TCP finds how fast it can send.
+"""
+
+import email.utils
+import random
+import threading
+import time
+
+
+class RetriesExhausted(Exception):
+    """ Raised when a request still fails after every retry """
+
+
+class AdaptiveRateLimiter:
+
+    DEFAULT_RATE = 5.0
+    DEFAULT_MAX_RATE = 20.0
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=0.2, max_rate=DEFAULT_MAX_RATE,
+                 increase=0.1, decrease=0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        # requests/second added per healthy response
+        self.increase = increase
+        # what the rate is multiplied by when the site pushes back
+        self.decrease = decrease
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        # allow a second's worth of requests to build up, so short idle
+        # spells can be made up for without bursting far over the rate
+        burst = max(1.0, self.rate)
+        self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def wait(self):
+        """ Blocks until a request can be sent """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retryAfter=None):
+        """ Slows down after the site pushed back, and stops everything for
+            retryAfter seconds if it said how long to wait
+        """
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            if retryAfter:
+                self.paused_until = max(self.paused_until, time.monotonic() + retryAfter)
+
+
+class RetryPolicy:
+
+    DEFAULT_MAX_ATTEMPTS = 8
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        """ :returns: a random delay up to an exponentially growing cap, so
+                      the threads that failed together don't retry together
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """ :returns: the seconds a Retry-After header asks us to wait, or None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retryAt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retryAt.timestamp() - time.time())
@@ -0,0 +1,68 @@
+""" Decodes the json of the pages of reviews. orjson is used when it's
+    installed, since it's several times faster than the json module. Pages
+    over stream_bytes are walked a review at a time with ijson when that's
+    installed, so a page of thousands of reviews isn't turned into
+    thousands of dicts at once.
+
+    Streaming only saves the dicts. The body is decoded from the response's
+    content, which has to be whole to be cached and checked for being cut
+    off, so memory is still bounded by the page rather than by the review.
+    async and pipeline mode also list a listing's rows before writing them,
+    so it's sync mode where streaming keeps the most out of memory.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class ReviewDecoder:
+
+    BACKENDS = ['auto', 'json', 'orjson', 'ijson']
+    DEFAULT_STREAM_BYTES = 4 * 1024 ** 2
+
+    def __init__(self, backend='auto', stream_bytes=DEFAULT_STREAM_BYTES):
+        if backend == 'orjson' and orjson is None:
+            raise ImportError("The orjson review decoder needs orjson installed")
+        if backend == 'ijson' and ijson is None:
+            raise ImportError("The ijson review decoder needs ijson installed")
+        self.backend = backend
+        # pages this big or bigger are streamed in auto
+        self.stream_bytes = stream_bytes
+
+    def decode(self, body):
+        """ Decodes a page of reviews, with its 'list' of reviews an iterator
+            when it's streamed
+            :returns: the page's json
+            :raises ValueError: if the page was cut off
+        """
+        if self.backend == 'ijson' or (self.backend == 'auto' and ijson is not None and
+                                       len(body) >= self.stream_bytes):
+            return self.stream(body)
+        if self.backend == 'json' or orjson is None:
+            return json.loads(body.decode('utf-8'))
+        return orjson.loads(body)
+
+    def stream(self, body):
+        """ :returns: the page's json with 'list' an iterator over its
+                      reviews, which are decoded from body as they're used
+        """
+        try:
+            # a page that was cut off has to be found out before any of its
+            # reviews are used, so it can be fetched again. Going through
+            # the events builds nothing, so it's cheap on memory.
+            for _ in ijson.parse(body):
+                pass
+            page = {'pagingContext': next(ijson.items(body, 'pagingContext', use_float=True))}
+        except (ijson.JSONError, StopIteration) as e:
+            raise ValueError("Couldn't decode the page of reviews: {}".format(e))
+        page['list'] = ijson.items(body, 'list.item', use_float=True)
+        return page
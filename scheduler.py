@@ -0,0 +1,104 @@
+""" Scrapes a list of cities with several worker processes. Cities are
+    handed out from a shared queue, so a worker that finishes early takes
+    the next city instead of sitting idle behind a huge one. Every city
+    keeps its own checkpoint in its output directory, so any worker can
+    pick up a city where the last run left it.
+"""
+
+import collections
+import logging
+import multiprocessing
+import os.path
+
+from log_config import stop_logging
+from metrics import run_profiled
+from scraper import get_city_dir, get_scraper
+
+
+def read_city_list(path):
+    """ Reads a file with a 'City, ST' per line. Blank lines and lines
+        starting with # are skipped.
+        :returns: a list of (city, state) tuples
+    """
+    cities = []
+    with open(path) as cityFile:
+        for line in cityFile:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            city, state = [ part.strip() for part in line.rsplit(',', 1) ]
+            cities.append((city, state))
+    return cities
+
+def get_city_checkpoint_file(city, state, name):
+    return os.path.join(get_city_dir(city, state), os.path.basename(name))
+
+def estimate_city_size(city, state):
+    """ Uses the size of the listing csv from earlier runs as a guess of how
+        long a city takes to scrape
+        :returns: the size in bytes, or None if we haven't scraped the city
+    """
+    directory = get_city_dir(city, state)
+    listingFile = os.path.join(directory, directory + '_listing.csv')
+    if os.path.exists(listingFile):
+        return os.path.getsize(listingFile)
+    return None
+
+def order_cities(cities):
+    """ Drops repeated cities, since two workers can't write the same files,
+        and puts the biggest cities first so they aren't the last ones
+        running. Cities we have no data for could be any size, so they go
+        first too.
+    """
+    unique = list(collections.OrderedDict.fromkeys(cities))
+    def biggest_first(cityState):
+        size = estimate_city_size(*cityState)
+        return (size is not None, -(size or 0))
+    return sorted(unique, key=biggest_first)
+
+def scrape_cities(args, cities, workers):
+    """ Scrapes cities with a scraper built from args in each of workers
+        processes
+    """
+    queue = multiprocessing.Queue()
+    for cityState in order_cities(cities):
+        queue.put(cityState)
+    # tells each worker there are no cities left
+    for _ in range(workers):
+        queue.put(None)
+
+    processes = [ multiprocessing.Process(target=run_worker, args=(workerNum, args, queue),
+                                          name='worker{}'.format(workerNum))
+                  for workerNum in range(1, workers + 1) ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+def run_worker(workerNum, args, queue):
+    """ Scrapes cities off the queue until it's empty """
+    scraper = get_scraper(args, log_file='logfile{}.log'.format(workerNum))
+    def scrape_queue():
+        for city, state in iter(queue.get, None):
+            logging.info("Worker %d taking %s, %s", workerNum, city, state)
+            scraper.CITY_LIST = [(city, state)]
+            scraper.use_checkpoint(get_city_checkpoint_file(city, state, args.checkpoint))
+            try:
+                scraper.scrape()
+            except Exception:
+                # the checkpoint lets the next run resume the city, so carry
+                # on with the rest of them
+                logging.exception("Failed scraping %s, %s", city, state)
+                scraper.close_csvs(save_progress=False)
+
+    profileOutput = None
+    if args.profile:
+        # a profile per worker, like the logs
+        name, ext = os.path.splitext(args.profile_output)
+        profileOutput = '{}{}{}'.format(name, workerNum, ext)
+    try:
+        run_profiled(scrape_queue, args.profile, profileOutput)
+    finally:
+        # worker processes exit without running atexit, which would write
+        # out the rest of the log
+        stop_logging()
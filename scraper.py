@@ -1,25 +1,54 @@
 #! /usr/bin/env python3.5
 
+import argparse
+import collections
 import configparser
-import csv
 import json
 import logging
+import math
 import os.path
 import requests
 import re
+import sys
 import time
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
+from concurrent.futures import ThreadPoolExecutor
+from checkpoint import CheckpointJournal
+from extractors import LISTING_EXTRACTORS, ListingPage, extract_listing
+from http_cache import CacheMiss, ResponseCache, ValidatorStore
+from incremental import load_city_index
+from log_config import DEFAULT_BACKUPS as DEFAULT_LOG_BACKUPS, start_logging
+from metrics import Metrics, run_profiled
+from rate_limit import AdaptiveRateLimiter, RetriesExhausted, RetryPolicy, parse_retry_after
+from review_json import ReviewDecoder
+from seen_listings import SeenListings
+from sinks import SINKS, CsvSink, FlushPolicy
 from pprint import pprint
 
 
+class ListingUnavailable(Exception):
+    """ Raised when a listing's page can't be had, like one that's been
+        taken down
+    """
+
+
+class ReviewsUnavailable(Exception):
+    """ Raised when a page of a listing's reviews can't be had """
+
+
+# what makes us give up on a single listing, rather than on the whole city
+LISTING_ERRORS = (RetriesExhausted, ListingUnavailable, ReviewsUnavailable)
+
+
 class CityScrape:
 
     BASE_URL = "https://www.vrbo.com"
     BASE_SEARCH_URL = BASE_URL + "/vacation-rentals"
     AJAX_URL = BASE_URL + "/ajax/review/unit/{}/getAllReviews"
-    # if this number is greater than the
-    # number of reviews for a listing, we will fetch them all
-    LARGE_PAGE_SIZE = 100000
+    # reviews are fetched this many at a time
+    DEFAULT_REVIEW_PAGE_SIZE = 100
+    # tries at getting a page of reviews that isn't cut off
+    REVIEW_PAGE_ATTEMPTS = 5
 
 
     CITY_LIST = [ ("New York", "NY",),
@@ -73,73 +102,242 @@ class CityScrape:
                   ("Charlotte", "NC",),
                   ("Concord", "SC",) ]
 
-    def __init__(self):
-        self.set_logging_config()
+    # how many connections to keep open to each host
+    DEFAULT_POOL_SIZE = 10
+
+    # save progress through a city after this many listings or seconds,
+    # whichever comes first
+    DEFAULT_CHECKPOINT_EVERY = 25
+    DEFAULT_CHECKPOINT_SECONDS = 30
+
+    # BeautifulSoup parsers to use, fastest first, when none is asked for
+    PARSERS = ['lxml', 'html.parser']
+
+    LISTING_FIELDNAMES = ['listing_id', 'listing_title', 'latitude',
+            'longitude', 'location_name', 'number_reviews',
+            'average_rating', 'average_nightly_price', 'nightly',
+            'weekend_night', 'property_protection_fee', 'cleaning_fee',
+            'tax_rate', 'min_stay', 'sleeps', 'bedrooms',
+            'bathrooms', 'property_type', 'internet',
+            'member_since', 'response_time', 'response_rate',
+            'calendar_last_updated', 'type', 'floor', 'sq_footage',
+            'max_occupancy', 'building_type', 'city', 'state']
+    REVIEW_FIELDNAMES = ['listing_id', 'total_number_reviews', 'n_review',
+            'reviewer_name', 'title', 'stars', 'stayed', 'source',
+            'submitted', 'city', 'state']
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, parser=None,
+                 config_file='last_info.ini', log_file='logfile.log',
+                 cache=None, replay=False,
+                 checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+                 checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS,
+                 incremental=False, review_page_size=DEFAULT_REVIEW_PAGE_SIZE,
+                 review_page_workers=1, rate_limiter=None, retry_policy=None,
+                 output='csv', database='vrbo.sqlite', metrics=None,
+                 validators=None, seen_listings=None, reviews_only=False,
+                 review_decoder=None, flush_policy=None, structured_log=False,
+                 log_backups=DEFAULT_LOG_BACKUPS):
+        self.set_logging_config(log_file, structured=structured_log, backups=log_backups)
+        # how long each stage of scraping a city takes
+        self.metrics = metrics or Metrics()
+        # what the rows are written with, one of sinks.SINKS, and where
+        # the sinks that take every city write to
+        self.sink_class = SINKS[output]
+        self.database = database
+        # when the csvs write out the rows they're holding
+        self.flush_policy = flush_policy
+        self.review_page_size = review_page_size
+        self.review_decoder = review_decoder or ReviewDecoder()
+        # fetches the pages after the first at the same time when more than 1
+        self.review_page_workers = review_page_workers
+        # only scrape what changed since the listings already in the csvs
+        self.incremental = incremental
+        # only scrape reviews, without the listing pages
+        self.reviews_only = reviews_only
+        self.city_index = {}
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self.use_checkpoint(config_file)
+        self.create_session(pool_size)
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retries = 0
+        # a ResponseCache, and whether to only use what's in it
+        self.cache = cache
+        # a ValidatorStore, for only fetching listing pages that changed
+        # when refreshing
+        self.validators = validators
+        # a SeenListings, for writing listings other cities already have
+        # without fetching them again
+        self.seen_listings = seen_listings
+        # href -> the data-spu of its search result, for the current city
+        self.listing_spus = {}
+        # the hrefs taken from seen_listings that haven't been written yet
+        self.reused_hrefs = set()
+        self.replay = replay
+        self.parser = parser or pick_parser(self.PARSERS)
+        logging.info("Parsing pages with %s", self.parser)
+
+    def create_session(self, pool_size):
+        """ Creates the session every request goes through, so connections
+            to the site are kept alive and reused instead of doing a new
+            TCP+TLS handshake for each page
+        """
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # includes br when brotli is installed
+        self.session.headers['Accept-Encoding'] = requests.utils.DEFAULT_ACCEPT_ENCODING
+        self.session.headers['Connection'] = 'keep-alive'
+
+    def get_connection_stats(self):
+        """ :returns: the number of requests made, connections opened and
+                      requests that reused an open connection
+        """
+        stats = {'requests': 0, 'connections': 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+        stats['reused'] = stats['requests'] - stats['connections']
+        return stats
+
+    def log_connection_stats(self):
+        stats = self.get_connection_stats()
+        logging.info("Made %(requests)d requests so far over %(connections)d connections "
+                     "(%(reused)d reused a connection)", stats)
+        logging.info("Retried %d requests so far, now allowing %.2f requests/second",
+                     self.retries, self.rate_limiter.rate)
+        if self.cache is not None:
+            logging.info("%d responses so far came from the cache, %d weren't in it",
+                         self.cache.hits, self.cache.misses)
+
+    def use_checkpoint(self, config_file):
+        """ Resumes from, and saves progress to, config_file, and the
+            journal of progress through the current city next to it
+        """
+        self.config_file = config_file
+        self.journal = CheckpointJournal(os.path.splitext(config_file)[0] + '.journal')
+        self.pending_href = None
         self.read_config()
 
     def read_config(self):
         self.config = configparser.ConfigParser()
-        self.config.read('last_info.ini')
+        # start from the beginning if there's no checkpoint yet
+        self.config['info'] = {'last_href_num': '0', 'last_city_num': '0'}
+        self.config.read(self.config_file)
         self.last_city_num = self.config.getint('info', 'last_city_num')
         self.last_href_num = self.config.getint('info','last_href_num')
+        self.last_href = self.config['info'].get('last_href', '')
 
     def update_last_city_num(self, idx):
         self.config['info']['last_city_num'] = str(idx + 1 + self.last_city_num)
         self.config['info']['last_city'] = self.cur_city + ',' + self.cur_state
-        self.update_config_file()
         # reset last href since we're in a new city
-        self.update_last_href_num(0, '')
-
-    def update_last_href_num(self, idx, href):
-        self.config['info']['last_href_num'] = str(idx + 1)
-        self.config['info']['last_href'] = str(href)
+        self.config['info']['last_href_num'] = '0'
+        self.config['info']['last_href'] = ''
+        self.last_href_num = 0
+        self.last_href = ''
         self.update_config_file()
+        self.journal.clear()
+        self.remove_saved_hrefs()
 
-    def update_config_file(self):
-        with open('last_info.ini', 'w') as configfile:
-            self.config.write(configfile)
+    def update_last_href_num(self, idx, href):
+        """ Notes that the listings up to idx are written. The progress is
+            only saved every checkpoint_every listings or checkpoint_seconds
+        """
+        if self.pending_href is None:
+            self.pending_since = time.time()
+            self.pending_count = 0
+        self.pending_href = (idx, href)
+        self.pending_count += 1
+        if (self.pending_count >= self.checkpoint_every or
+                time.time() - self.pending_since >= self.checkpoint_seconds):
+            self.commit_checkpoint()
 
-    def update_csvs(self):
-        listing_fieldnames = ['listing_id', 'listing_title', 'latitude',
-                'longitude', 'location_name', 'number_reviews',
-                'average_rating', 'average_nightly_price', 'nightly',
-                'weekend_night', 'property_protection_fee', 'cleaning_fee',
-                'tax_rate', 'min_stay', 'sleeps', 'bedrooms',
-                'bathrooms', 'property_type', 'internet',
-                'member_since', 'response_time', 'response_rate',
-                'calendar_last_updated', 'type', 'floor', 'sq_footage',
-                'max_occupancy', 'building_type', 'city']
-        review_fieldnames = ['listing_id', 'total_number_reviews', 'n_review',
-                'reviewer_name', 'title', 'stars', 'stayed', 'source',
-                'submitted']
-
-        self.listing_csv, self._listing_csv = self.create_or_open_file('listing', listing_fieldnames)
-        self.review_csv, self._review_csv = self.create_or_open_file('review', review_fieldnames)
-
-    def close_csvs(self):
-        """ closes the csv files used """
-        self._listing_csv.close()
-        self._review_csv.close()
+    def commit_checkpoint(self):
+        """ Saves the progress noted by update_last_href_num """
+        if self.pending_href is None:
+            return
+        idx, href = self.pending_href
+        # add one because it's 0 based indexing
+        self.journal_progress(idx + 1, href)
+        self.pending_href = None
 
-    def create_or_open_file(self, suffix, fieldnames):
-        """ creates or opens the csv files we need to use """
-        directory, full_file_path = self.get_cur_city_filename(suffix)
+    def journal_progress(self, nextHrefNum, href):
+        """ Makes sure the rows so far are on disk, then journals the
+            progress they make up along with how much of each sink they fill
+        """
+        offsets = {}
+        with self.metrics.timer('checkpoint'):
+            for suffix, sink in (('listing', self.listing_sink), ('review', self.review_sink)):
+                offsets[suffix] = sink.sync()
+        self.journal.append(self.cur_city, self.cur_state, nextHrefNum, href, offsets)
 
-        self.ensure_dir_is_created(directory)
+    def resume_cur_city(self):
+        """ Picks up from the last journal entry for the current city,
+            cutting off any rows written after it
+        """
+        entry = self.journal.read_last(self.cur_city, self.cur_state)
+        if entry is None:
+            # mark where the csvs start, so whatever is written before the
+            # first checkpoint can be cut off too
+            self.journal_progress(self.last_href_num, self.last_href)
+            return
+        self.last_href_num = entry['next_href_num']
+        self.last_href = entry['last_href']
+        logging.info("Resuming %s, %s after %s", self.cur_city, self.cur_state,
+                     entry['last_href'])
+        for suffix, sink in (('listing', self.listing_sink), ('review', self.review_sink)):
+            sink.truncate(entry['offsets'][suffix])
 
-        exists = False
-        if os.path.exists(full_file_path):
-            exists = True
+    def update_config_file(self):
+        """ Replaces the config file in one step, so a crash can't leave it
+            half written
+        """
+        tmpFile = self.config_file + '.tmp'
+        with open(tmpFile, 'w') as configfile:
+            self.config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.replace(tmpFile, self.config_file)
 
-        file_ = open(full_file_path, 'a')
+    def update_csvs(self):
+        """ opens the sinks the current city's listings and reviews are
+            written to
+        """
+        self.listing_sink = self.create_or_open_file('listing', self.LISTING_FIELDNAMES)
+        self.review_sink = self.create_or_open_file('review', self.REVIEW_FIELDNAMES)
 
-        new_csv = csv.DictWriter(file_,
-                fieldnames=fieldnames, quoting=csv.QUOTE_MINIMAL)
+    def close_csvs(self, save_progress=True):
+        """ saves the progress through the city and closes the sinks used.
+            After an error the progress isn't saved, since the sinks can hold
+            part of a listing that the last listing written doesn't cover,
+            and resuming cuts them back to the last checkpoint instead.
+        """
+        if save_progress and not self.listing_sink.closed:
+            self.commit_checkpoint()
+        self.listing_sink.close()
+        self.review_sink.close()
 
-        if not exists:
-            new_csv.writeheader()
+    def create_or_open_file(self, suffix, fieldnames):
+        """ creates or opens the csv (or other sink) we need to use """
+        # the city's saved hrefs go in its directory, whatever the sink
+        self.ensure_dir_is_created(get_city_dir(self.cur_city, self.cur_state))
+        if self.sink_class.SHARED:
+            return self.sink_class(self.database, fieldnames, suffix,
+                                   city=self.cur_city, state=self.cur_state)
 
-        return new_csv, file_
+        _, full_file_path = self.get_cur_city_filename(suffix, self.sink_class.EXTENSION)
+        if self.sink_class is CsvSink:
+            return CsvSink(full_file_path, fieldnames, flush_policy=self.flush_policy)
+        return self.sink_class(full_file_path, fieldnames)
 
     def ensure_dir_is_created(self, directory):
         try:
@@ -147,219 +345,589 @@ class CityScrape:
         except:
             pass
 
-    def get_cur_city_filename(self, suffix):
+    def get_cur_city_filename(self, suffix, extension='.csv'):
         """ returns the path/name of the current city's file """
-        city = self.cur_city.replace(' ', '_')
-        directory = "{city}_{state}".format(city=city, state=self.cur_state)
-        filename = "{city}_{state}_{type}.csv".format(city=city, state=self.cur_state,
-                type=suffix)
+        directory = get_city_dir(self.cur_city, self.cur_state)
+        filename = "{dir}_{type}{ext}".format(dir=directory, type=suffix, ext=extension)
         return directory, directory + "/" + filename
 
-    def set_logging_config(self):
-        # logs to file
-        logging.basicConfig(level=logging.INFO,
-                            format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                            datefmt='%m-%d %H:%M',
-                            filename='logfile.log',
-                            filemode='w')
-        # define a Handler which writes INFO messages or higher to the sys.stderr
-        self.console = logging.StreamHandler()
-        self.console.setLevel(logging.DEBUG)
-        # set a format which is simpler for console use
-        formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
-        # tell the handler to use this format
-        self.console.setFormatter(formatter)
-        # add the handler to the root logger
-        logging.getLogger('').addHandler(self.console)
-
-        # suppress requests and urllib3 logging messages
-        logging.getLogger("requests").setLevel(logging.WARNING)
-        logging.getLogger("urllib3").setLevel(logging.WARNING)
+    def set_logging_config(self, log_file, structured=False, backups=DEFAULT_LOG_BACKUPS):
+        # logs to file and the console through a queue, so writing the log
+        # happens off the threads scraping
+        self.console = start_logging(log_file, structured=structured, backups=backups)
 
     def scrape(self):
         """ Goes through all the cities and collects data for each city """
         for idx, locTuple in enumerate(self.CITY_LIST[self.last_city_num:]):
             self.cur_city = locTuple[0]
             self.cur_state = locTuple[1]
+            self.metrics.reset()
+            self.listing_spus = {}
             self.update_csvs()
-            # collects all the pages of results when searching for a city
-            listingHrefs = self.get_all_listings_for_cur_city()
-            # visits each result to collect the data
-            self.get_all_listing_data_for_city(listingHrefs)
-            self.update_last_city_num(idx)
+            self.resume_cur_city()
+            if self.incremental:
+                self.city_index = load_city_index(self.listing_sink.read_rows(),
+                                                  self.review_sink.read_rows())
+            # collects all the pages of results when searching for a city,
+            # unless we already did before stopping part way through it
+            listingHrefs = self.load_saved_hrefs()
+            if listingHrefs is None and not self.last_href_num:
+                # nothing to resume from, so the listings can be visited
+                # while the rest of the results are still coming in
+                self.search_and_scrape_cur_city()
+            else:
+                if listingHrefs is None:
+                    listingHrefs = self.get_all_listings_for_cur_city()
+                self.last_href_num = self.get_resume_index(listingHrefs)
+                # visits each result to collect the data
+                self.get_all_listing_data_for_city(listingHrefs)
+            # the rows have to be on disk before the city is marked done
             self.close_csvs()
+            self.update_last_city_num(idx)
+            self.log_connection_stats()
+            self.dump_metrics()
+
+    def dump_metrics(self):
+        """ Logs how the current city went and saves the metrics for it
+            next to its data
+        """
+        logging.info("Finished %s, %s: %s", self.cur_city, self.cur_state,
+                     self.metrics.summary())
+        directory = get_city_dir(self.cur_city, self.cur_state)
+        self.metrics.dump("{dir}/{dir}_metrics.json".format(dir=directory))
+
+    def get_hrefs_filename(self):
+        """ returns the path/name of the file the current city's hrefs are
+            saved in while we scrape it
+        """
+        directory = get_city_dir(self.cur_city, self.cur_state)
+        return "{dir}/{dir}_hrefs.json".format(dir=directory)
+
+    def save_hrefs(self, listingHrefs):
+        """ Saves the hrefs found for the current city, so resuming the city
+            doesn't have to go through the search results again
+        """
+        filename = self.get_hrefs_filename()
+        with open(filename + '.tmp', 'w') as hrefsFile:
+            json.dump({'crawled': time.time(), 'hrefs': listingHrefs,
+                       'spus': self.listing_spus}, hrefsFile)
+        os.replace(filename + '.tmp', filename)
+
+    def load_saved_hrefs(self):
+        """ :returns: the hrefs saved for the current city, or None """
+        try:
+            with open(self.get_hrefs_filename()) as hrefsFile:
+                saved = json.load(hrefsFile)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.error("Couldn't read the saved hrefs for %s, %s",
+                          self.cur_city, self.cur_state)
+            return None
+        logging.info("Using the %d hrefs for %s, %s found at %s",
+                     len(saved['hrefs']), self.cur_city, self.cur_state,
+                     time.strftime('%Y-%m-%d %H:%M', time.localtime(saved['crawled'])))
+        self.listing_spus = saved.get('spus', {})
+        return saved['hrefs']
+
+    def remove_saved_hrefs(self):
+        try:
+            os.remove(self.get_hrefs_filename())
+        except FileNotFoundError:
+            pass
+
+    def get_resume_index(self, listingHrefs):
+        """ Finds where to pick the city back up by the last listing we
+            wrote, rather than its position, in case the results moved
+            :returns: the index of the first href still to scrape
+        """
+        if self.last_href:
+            try:
+                return listingHrefs.index(self.last_href) + 1
+            except ValueError:
+                logging.error("Last listing %s isn't in the results anymore, "
+                              "resuming from #%d", self.last_href, self.last_href_num)
+        return self.last_href_num
 
     def get_all_listings_for_cur_city(self):
-        """ Determines how many pages of results there are for a city, and
-            then goes through that many pages and collects the href of each
-            listing
+        """ Goes through all the pages of results for the current city and
+            collects the href of each listing
             :returns: hrefs of all the listings for a city
         """
         listingHrefs = [] # will be a list of '/XXXXXXha' or '/XXXXXX' to visit
-        # find out how many pages there are, and get all the listings
-        # for all those pages
-        pageCount = self.get_page_count(self.cur_city, self.cur_state)
-        for page in range(1, pageCount + 1):
-            listingHrefs += self.get_city_listing(self.cur_city, self.cur_state, page)
+        for hrefs in self.iter_listings_for_cur_city():
+            listingHrefs += hrefs
         return listingHrefs
 
+    def iter_listings_for_cur_city(self):
+        """ Fetches the first page of results for the current city, which
+            says how many pages there are, and then the rest of them. The
+            hrefs are saved once they're all in.
+            :returns: an iterator of the new hrefs on each page, as soon as
+                      it's fetched
+        """
+        firstPage = self.request_city_listing(self.cur_city, self.cur_state)
+        pageCount = self.read_page_count(firstPage, self.cur_city, self.cur_state)
+        seen = set()
+        listingHrefs = []
+        for page in range(1, pageCount + 1):
+            if page == 1:
+                soup = firstPage
+            else:
+                soup = self.request_city_listing(self.cur_city, self.cur_state, page)
+            hrefs = self.get_new_hrefs(soup, seen)
+            listingHrefs += hrefs
+            if page == pageCount:
+                self.save_hrefs(listingHrefs)
+            yield hrefs
+
+    def get_new_hrefs(self, soup, seen):
+        """ Sponsored listings show up on more than one page of results, so
+            only the hrefs that aren't in seen are kept, in order. Notes the
+            data-spu of each one.
+            :returns: the hrefs of a page of results not seen before, which
+                      are added to seen
+        """
+        hrefs = []
+        for href, spu in self.get_cards(soup):
+            if href not in seen:
+                seen.add(href)
+                hrefs.append(href)
+                self.listing_spus[href] = spu
+        return hrefs
+
+    def search_and_scrape_cur_city(self):
+        """ Visits the listings on each page of results as soon as it's
+            fetched, rather than after all the pages are
+        """
+        hrefNum = 0
+        for hrefs in self.iter_listings_for_cur_city():
+            for href in hrefs:
+                listing_data, review_rows = self.get_data_for_listing(href)
+                self.write_listing_data(hrefNum, href, listing_data, review_rows)
+                hrefNum += 1
+
     def get_all_listing_data_for_city(self, listingHrefs):
         # return because the last href we visited was the last
         # one of the city
-        if self.last_href_num >= len(listingHrefs) - 1:
+        if self.last_href_num >= len(listingHrefs):
             return
 
         for idx, href in enumerate(listingHrefs[self.last_href_num:]):
-            listing_data = self.get_data_for_listing(href)
-            self.listing_csv.writerow(listing_data)
-            logging.info("Writing listing data to file")
+            listing_data, review_rows = self.get_data_for_listing(href)
+            self.write_listing_data(idx + self.last_href_num, href,
+                                    listing_data, review_rows)
+
+    def write_listing_data(self, idx, href, listing_data, review_rows):
+        """ Writes a listing's reviews and data to the csvs and moves the
+            checkpoint past it. Listings must be written in href order so the
+            checkpoint stays valid.
+        """
+        # the review rows can still be fetching pages as they're written,
+        # so only the writes themselves are timed
+        writeTime = 0.0
+        self.review_sink.mark()
+        # the rows are only kept to record the listing as seen, and not for
+        # listings with too many reviews to hold on to
+        written = [] if self.seen_listings is not None else None
+        # looked up once, rather than for every review
+        logRows = logging.getLogger().isEnabledFor(logging.DEBUG)
+        try:
+            for row in review_rows:
+                if logRows:
+                    logging.debug(row)
+                start = time.perf_counter()
+                self.review_sink.writerow(row)
+                writeTime += time.perf_counter() - start
+                if written is not None:
+                    written.append(row)
+                    if len(written) > SeenListings.MAX_REVIEWS:
+                        written = None
+        except LISTING_ERRORS as e:
+            # a later page of reviews failed. Neither the listing nor the
+            # reviews already written are kept, so the next crawl or refresh
+            # scrapes it from the start rather than adding them again
+            self.review_sink.rollback()
+            self.give_up_on_listing(href, e)
+            listing_data = None
+        logging.debug("Wrote review data to file")
+
+        # listings that haven't changed aren't written again when refreshing
+        if listing_data is not None:
+            start = time.perf_counter()
+            self.listing_sink.writerow(listing_data)
+            writeTime += time.perf_counter() - start
+            logging.debug("Writing listing data to file")
             logging.debug(listing_data)
-            # add one because it's 0 based indexing
-            self.update_last_href_num(idx + self.last_href_num, href)
+        self.metrics.observe('write', writeTime)
+        self.record_seen_listing(href, listing_data, written)
+        self.metrics.count('listings')
+        self.update_last_href_num(idx, href)
+        self.metrics.maybe_log_summary()
 
     def get_data_for_listing(self, href):
-        """ Scrape the data for a specific listing
-            :returns: listing data to be saved to csv or txt file
-        """
-        logging.info("Getting data for {}".format(self.get_base_url() + href))
-        soup = self.request_listing_data(href)
-        soup = self.get_loaded_page(soup, href)
-        numReviews = self.get_all_reviews_from_listing(soup, href)
-        row = {}
-        LISTING_ATTRS = {
-            'listing_id': "href[1:]",
-            'listing_title':"soup.find('span', class_='listing-headline-text').text.strip()",
-            'latitude':"float(soup.find('meta', attrs={'property': 'homeaway:location:latitude'})['content'])",
-            'longitude':"float(soup.find('meta', attrs={'property': 'homeaway:location:longitude'})['content'])",
-            'location_name':"soup.find('a', class_='js-breadcrumbLink').text.strip()",
-            'number_reviews':"numReviews",
-            'average_rating':"float(re.search('(\d*\.\d*)', soup.find('div', class_='rating')['title']).group(0))",
-            'average_nightly_price':"int(soup.find('div', class_='price-large').text.strip()[1:])",
-            'min_stay':"int(re.search('\d+', soup.find(text = 'Minimum Stay').parent.nextSibling.nextSibling.text).group())",
-            'sleeps':"int(soup.find(text = 'Sleeps').parent.nextSibling.text)",
-            'bedrooms':"soup.find(text = 'Bedrooms').parent.nextSibling.nextSibling.text",
-            'bathrooms':"int(soup.find(text = 'Bathrooms').parent.nextSibling.text)",
-            'property_type':"soup.find('div', id='propertyType').nextSibling.nextSibling.find('li').text.strip()",
-            'internet':"'Yes' if soup.find(text=re.compile('Internet')) else 'No'",
-            'member_since':"re.search('(\d+)', soup.find('div', class_='advertiser-date').text.strip()).group(1)",
-            'response_time':"soup.find(text=re.compile('response time', re.IGNORECASE)).parent.find('strong').text",
-            'response_rate':"soup.find(text=re.compile('Response rate')).parent.find('strong').text",
-            'calendar_last_updated':"soup.find(text=re.compile('Calendar last updated')).parent.find('strong').text",
-            'type':"soup.find('div', id='propertyType').nextSibling.nextSibling.find('li').text.strip()",
-            'floor':"re.search('(\d+)', soup.find('div', id='propertyType').nextSibling.nextSibling.nextSibling.nextSibling.find('li').text).group(1)",
-            'sq_footage':"re.search('\d+', soup.find('div', text='Floor Area:').nextSibling.nextSibling.find('li').text).group(0)",
-            'max_occupancy':"int(soup.find(text=re.compile('Max. occupancy')).parent.find('span').text.strip())",
-            'building_type':"soup.find('div', id='buildingtype').nextSibling.nextSibling.find('li').text.strip()",
-            'nightly': "re.search('\d+',soup.find('div', class_='ratePeriodTitle', text=re.compile('standard', re.IGNORECASE)).parent.parent.find('td', class_='nightly').find(class_='rate').text).group()",
-            'weekend_night': "re.search('\d+',soup.find('div', class_='ratePeriodTitle', text=re.compile('standard', re.IGNORECASE)).parent.parent.find('td', class_='weekendNight').find(class_='rate').text).group()",
-            'property_protection_fee':"re.search('\d+', soup.find(class_='additionalInfo').find(text=re.compile('property protection', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
-            'cleaning_fee':"re.search('\d+', soup.find(class_='additionalInfo').find(text=re.compile('cleaning fee', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
-            'tax_rate':"re.search('\d+[.]?\d*%', soup.find(class_='additionalInfo').find(text=re.compile('tax rate', re.IGNORECASE)).parent.nextSibling.nextSibling.text).group()",
-            'city':"self.cur_city",
-        }
-
-        for attr, code in LISTING_ATTRS.items():
-            try:
-                row[attr] = eval(code)
-            except:
-                logging.error("Could not retrieve {} attribute!!".format(attr))
-                row[attr] = ''
+        """ Scrape the data for a specific listing, giving up on it if the
+            site won't give it to us
+            :returns: listing data to be saved to csv or txt file, and the
+                      review rows for the listing, or None and no review
+                      rows if we gave up on it
+        """
+        try:
+            if self.reviews_only:
+                return self.get_reviews_for_listing(href)
+            return self.scrape_listing(href)
+        except LISTING_ERRORS as e:
+            self.give_up_on_listing(href, e)
+            return None, []
+
+    def give_up_on_listing(self, href, error):
+        """ Moves on from a listing the site wouldn't give us, like one that
+            never fully loads
+        """
+        logging.error("Giving up on %s: %s", href, error)
+        self.metrics.count('failed_listings')
+
+    def scrape_listing(self, href):
+        """ :returns: the same as get_data_for_listing, raising one of
+                      LISTING_ERRORS if the site won't give us the listing
+        """
+        logging.info("Getting data for %s%s", self.get_base_url(), href)
+        reused = self.reuse_seen_listing(href)
+        if reused is not None:
+            return reused
+        saved = self.get_saved_validators(href)
+        resp = self.request_listing_page(href, saved)
+        if resp.status_code == 304:
+            return self.reuse_unmodified_listing(href, saved)
+
+        soup = self.soupify(resp)
+        page = self.get_loaded_page(soup, href)
+        if page is None:
+            return None, []
+        timings = {}
+        row = extract_listing(page, timings)
+        self.record_extract_timings(timings)
+        # a page that had to be fetched again wasn't the one resp is for
+        if page.soup is soup:
+            self.save_validators(href, resp, page.api_listing_id, row)
+
+        return self.get_all_reviews_from_listing(page.api_listing_id, href, row)
+
+    def get_reviews_for_listing(self, href):
+        """ Scrapes only the reviews of a listing, which doesn't need its
+            page when we already have its api listing id
+            :returns: no listing data, and the review rows for the listing,
+                      only the new ones if we're refreshing
+        """
+        logging.info("Getting reviews for %s%s", self.get_base_url(), href)
+        apiListingId = self.get_api_listing_id(href)
+        if apiListingId is None:
+            return None, []
+        known = self.city_index.get(href[1:]) if self.incremental else None
+        if known is None:
+            _, review_rows = self.request_all_review_data(apiListingId, href)
+            return None, review_rows
+
+        # a single review is enough to find out how many there are
+        totalResults = self.request_review_page(apiListingId, 1, 1)['pagingContext']['totalResults']
+        if totalResults <= known.last_n_review:
+            logging.info("%s has no new reviews", href)
+            return None, []
+        _, review_rows = self.request_all_review_data(apiListingId, href)
+        return None, self.renumber_new_reviews(review_rows, known, totalResults)
+
+    def get_api_listing_id(self, href):
+        """ Finds the id the reviews of a listing are fetched with. It's the
+            data-spu of the listing's search result, or was saved with the
+            validators when its page was last fetched, and only if neither
+            has it is the page fetched for it.
+            :returns: the api listing id, or None if the page never loaded
+        """
+        spu = self.listing_spus.get(href)
+        if spu:
+            return spu
+        if self.validators is not None:
+            saved = self.validators.get(self.get_base_url() + href)
+            if saved is not None:
+                return saved[1]['api_listing_id']
+        page = self.get_loaded_page(self.request_listing_data(href), href)
+        return page.api_listing_id if page is not None else None
+
+    def get_saved_validators(self, href):
+        """ :returns: the conditional headers and data saved when the
+                      listing's page was last fetched, or None if there's
+                      nothing saved we can use
+        """
+        # only 200s are cached, so a 304 would leave the page out of the
+        # cache and a replay of it without the listing
+        if self.validators is None or self.cache is not None:
+            return None
+        saved = self.validators.get(self.get_base_url() + href)
+        # rows saved before a field was added can't be used
+        if saved is None or any(attr not in saved[1]['row'] for attr in LISTING_EXTRACTORS):
+            return None
+        return saved
+
+    def save_validators(self, href, resp, apiListingId, row):
+        """ Saves what the next crawl needs to skip parsing the listing's
+            page if it hasn't changed: the id for the reviews and the row
+            the page gave
+        """
+        if self.validators is not None:
+            self.validators.put(self.get_base_url() + href, resp,
+                                {'api_listing_id': apiListingId, 'row': row})
+
+    def reuse_unmodified_listing(self, href, saved):
+        """ The site said the listing's page hasn't changed, so the row it
+            gave last time is used instead of parsing it again. The page can
+            have been fetched for another city, and its reviews can still
+            have changed.
+            :returns: the same as get_data_for_listing
+        """
+        logging.info("%s hasn't changed since it was last fetched", href)
+        self.metrics.count('not_modified')
+        row = dict(saved[1]['row'], city=self.cur_city, state=self.cur_state)
+        return self.get_all_reviews_from_listing(saved[1]['api_listing_id'], href, row)
+
+    def reuse_seen_listing(self, href):
+        """ Takes the rows of a listing that was scraped lately for another
+            city, likely a neighbouring one, and gives them this city's city
+            and state. Listings a refresh already has are always scraped
+            again, since that's what it's checking.
+            :returns: the same as get_data_for_listing, or None if the
+                      listing has to be scraped
+        """
+        if self.seen_listings is None or (self.incremental and href[1:] in self.city_index):
+            return None
+        seen = self.seen_listings.get(href[1:], self.listing_spus.get(href, ''))
+        cityState = '{}, {}'.format(self.cur_city, self.cur_state)
+        if seen is None or seen[0] == cityState:
+            return None
+        city, row, review_rows = seen
+        logging.info("Already scraped %s for %s", href, city)
+        self.metrics.count('seen_reused')
+        self.reused_hrefs.add(href)
+        where = {'city': self.cur_city, 'state': self.cur_state}
+        return dict(row, **where), [ dict(review, **where) for review in review_rows ]
+
+    def record_seen_listing(self, href, row, review_rows):
+        """ Keeps a listing that was just scraped with all of its reviews,
+            for the cities after this one that have it too. review_rows is
+            None for a listing with more than SeenListings.MAX_REVIEWS, which
+            every city scrapes for itself.
+        """
+        if self.seen_listings is None or href in self.reused_hrefs:
+            self.reused_hrefs.discard(href)
+            return
+        if row is None or review_rows is None:
+            return
+        # a refresh only gets the new reviews of the listings it has
+        if self.incremental and href[1:] in self.city_index:
+            return
+        self.seen_listings.put(href[1:], self.listing_spus.get(href, ''),
+                               '{}, {}'.format(self.cur_city, self.cur_state),
+                               row, review_rows)
 
-        return row
+    def record_extract_timings(self, timings):
+        """ Records how long each field of a listing took to extract, and
+            all of them together
+        """
+        for attr, seconds in timings.items():
+            self.metrics.observe('extract.' + attr, seconds)
+        self.metrics.observe('extract', sum(timings.values()))
 
-    def get_all_reviews_from_listing(self, soup, href):
+    def get_all_reviews_from_listing(self, apiListingId, href, row):
         """ Makes an api call to the website to get the json of all the reviews
+            :returns: row with number_reviews filled in and the review rows,
+                      or None and no review rows if we're refreshing and
+                      the listing hasn't changed
         """
         logging.info("Finding the listing data we need to make the ajax call for the reviews")
-        soup = self.get_loaded_page(soup, href)
-        data_spu = soup.select('li.dropdown.favorite-button.js-favoriteButtonView')
-        apiListingID = data_spu[0]['data-spu']
+        known = self.city_index.get(href[1:]) if self.incremental else None
+        if known is None:
+            row['number_reviews'], review_rows = self.request_all_review_data(apiListingId, href)
+            return row, review_rows
+
+        # a single review is enough to find out how many there are
+        row['number_reviews'] = self.request_review_page(apiListingId, 1, 1)['pagingContext']['totalResults']
+        if known.is_unchanged(row):
+            logging.info("%s hasn't changed since it was last scraped", href)
+            return None, []
 
-        return self.request_all_review_data(apiListingID, href)
+        logging.info("%s has changed, getting its new reviews", href)
+        _, review_rows = self.request_all_review_data(apiListingId, href)
+        return row, self.renumber_new_reviews(review_rows, known, row['number_reviews'])
+
+    def renumber_new_reviews(self, review_rows, known, totalResults):
+        """ Drops the reviews we already have and numbers the new ones on
+            from the ones we have. The pages of reviews aren't in any order
+            we can count on, so they're gone through until all
+            totalResults - known.last_n_review new ones are found, and no
+            further.
+        """
+        reviewNum = known.last_n_review
+        if reviewNum >= totalResults:
+            return
+        for review in review_rows:
+            if known.is_new_review(review):
+                reviewNum += 1
+                review['n_review'] = reviewNum
+                yield review
+                if reviewNum >= totalResults:
+                    return
 
     def get_loaded_page(self, soup, href):
         """ Sometimes it seems the page isn't fully loaded before being
             returned, so we test again to make sure we get a fully loaded page
+            :returns: a ListingPage for the fully loaded page, or None if
+                      it never loaded
         """
-        notSuccessful = True
-        while notSuccessful:
-            # find the data we need to make the ajax api call ourselves
-            # use the select method here because we want multiple classes
-            data_spu = soup.select('li.dropdown.favorite-button.js-favoriteButtonView')
-            try:
-                # finds the "vrbo-XXXXXX-XXXXXXX' or 'trips-XXXXXX-XXXXXXX'
-                apiListingID = data_spu[0]['data-spu']
-                notSuccessful = False
-            except IndexError:
-                logging.error("Failed to find the api-id information for a listing. Probably didn't have enough time for page to load. Retrying...")
-                time.sleep(1)
-                soup = self.request_listing_data(href)
-        return soup
+        page = ListingPage(soup, href, self.cur_city, state=self.cur_state)
+        # the data-spu is the data we need to make the ajax api call ourselves
+        attempt = 0
+        while page.api_listing_id is None:
+            # replaying would only get the same page from the cache again
+            if self.replay or attempt + 1 >= self.retry_policy.max_attempts:
+                logging.error("Giving up on %s, it never fully loaded", href)
+                return None
+            logging.error("Failed to find the api-id information for a listing. Probably didn't have enough time for page to load. Retrying...")
+            time.sleep(self.retry_policy.get_delay(attempt))
+            attempt += 1
+            # don't keep getting the same partly loaded page from the cache
+            self.discard_cached(self.get_base_url() + href)
+            page = ListingPage(self.request_listing_data(href), href, self.cur_city,
+                               state=self.cur_state)
+        return page
 
 
     def request_all_review_data(self, apiListingId, href):
-        """ Gets the json data for all the reviews from a listing """
+        """ Gets the first page of reviews for a listing, and the rest of the
+            pages as the rows are used, so only a page is held at a time
+            :returns: the total number of reviews and an iterator over a row
+                      for each review
+        """
+        firstPage = self.request_review_page(apiListingId, 1, self.review_page_size)
+        totalResults = firstPage['pagingContext']['totalResults']
+        pageCount = max(1, math.ceil(totalResults / self.review_page_size))
+        pages = self.iter_review_pages(apiListingId, firstPage, pageCount)
+        return totalResults, self.iter_review_rows(pages, href, totalResults)
+
+    def iter_review_pages(self, apiListingId, firstPage, pageCount):
+        """ Yields the json of each page of reviews, in order. Pages are only
+            fetched ahead as far as there are workers, so no more are
+            fetched once the caller stops going through them.
+        """
+        yield firstPage
+        pageNums = range(2, pageCount + 1)
+        if self.review_page_workers > 1 and len(pageNums) > 1:
+            with ThreadPoolExecutor(max_workers=self.review_page_workers) as executor:
+                pending = collections.deque()
+                for pageNum in pageNums:
+                    pending.append(executor.submit(self.request_review_page, apiListingId,
+                                                   pageNum, self.review_page_size))
+                    if len(pending) >= self.review_page_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+        else:
+            for pageNum in pageNums:
+                yield self.request_review_page(apiListingId, pageNum, self.review_page_size)
+
+    def iter_review_rows(self, pages, href, totalResults):
+        """ Yields a row for the review csv for each review in pages """
+        reviewNum = 0
+        for page in pages:
+            for review in page['list']:
+                reviewNum += 1
+                row = {}
+                # we use the first character through the end since it's a url
+                row['listing_id'] = href[1:]
+                row['total_number_reviews'] = totalResults
+                row['n_review'] = reviewNum
+                row['reviewer_name'] = review['reviewer']['nickname']
+                row['title'] = review['headline']
+                row['stars'] = review['rating']
+                row['stayed'] = review['arrivalDate']
+                row['source'] = 'VRBO'
+                row['submitted'] = review['createdDate']
+                row['city'] = self.cur_city
+                row['state'] = self.cur_state
+                yield row
+
+    def request_review_page(self, apiListingId, pageNum, pageSize):
+        """ Gets one page of the json data for the reviews from a listing.
+            A page that gets cut off is fetched again on its own, rather
+            than starting the listing's reviews over.
+            :returns: the json for the page
+            :raises ReviewsUnavailable: if the site won't give us the page
+        """
         apiReviewURL = self.get_ajax_url().format(apiListingId)
-        logging.info("Getting all review data for {}".format(apiReviewURL))
-        apiParams = {"pageNum": 1, "pageSize": self.LARGE_PAGE_SIZE}
-        reviews = self.request_url(apiReviewURL, params=apiParams)
-        reviewsJson = reviews.json()
-        for reviewNum, review in enumerate(reviewsJson['list']):
-            row = {}
-            # we use the first character through the end since it's a url
-            row['listing_id'] = href[1:]
-            row['total_number_reviews'] = reviewsJson['pagingContext']['totalResults']
-            row['n_review'] = reviewNum + 1 # adjust for zero indexed
-            row['reviewer_name'] = review['reviewer']['nickname']
-            row['title'] = review['headline']
-            row['stars'] = review['rating']
-            row['stayed'] = review['arrivalDate']
-            row['source'] = 'VRBO'
-            row['submitted'] = review['createdDate']
-            logging.debug(row)
-            self.review_csv.writerow(row)
-
-        logging.info("Wrote review data to file")
-
-        return reviewsJson['pagingContext']['totalResults']
-
-    def get_city_listing(self, city, state, pageNum):
-        """ Fetches and parses the listing hrefs for a page of
-            results for a given city.
-            :returns: hrefs for all the listings on one page of results
-        """
-        soup = self.request_city_listing(city, state, pageNum)
-        return self.get_hrefs(soup)
+        apiParams = {"pageNum": pageNum, "pageSize": pageSize}
+        logging.info("Getting page #%d of review data for %s", pageNum, apiReviewURL)
+        for attempt in range(self.REVIEW_PAGE_ATTEMPTS):
+            reviews = self.request_url(apiReviewURL, params=apiParams)
+            # request_url already retried the errors worth retrying
+            if reviews.status_code != 200:
+                raise ReviewsUnavailable("Got a {} for page #{} of reviews for {}".format(
+                        reviews.status_code, pageNum, apiReviewURL))
+            try:
+                with self.metrics.timer('decode'):
+                    return self.review_decoder.decode(reviews.content)
+            except ValueError:
+                if self.replay:
+                    raise ReviewsUnavailable("Page #{} of reviews for {} was cut off "
+                                             "when it was cached".format(pageNum, apiReviewURL))
+                logging.error("Page #%d of reviews for %s was cut off. Re-trying...",
+                              pageNum, apiReviewURL)
+                self.discard_cached(apiReviewURL, apiParams)
+                time.sleep(self.retry_policy.get_delay(attempt))
+        raise ReviewsUnavailable("Page #{} of reviews for {} was cut off every time".format(
+                pageNum, apiReviewURL))
 
     def request_listing_data(self, href):
         """ Fetches the page for a specific listing
             :returns: a BeautifulSoup object of the listing page
         """
-        logging.info("Fetching listing for {}".format(self.get_base_url() + href))
-        resp = self.request_url(self.get_base_url() + href)
-        return self.soupify(resp)
+        return self.soupify(self.request_listing_page(href))
+
+    def request_listing_page(self, href, saved=None):
+        """ Fetches the page for a specific listing, only if it's changed
+            when there are saved validators for it
+            :returns: the response for the listing page, a 304 if it hasn't
+                      changed
+            :raises ListingUnavailable: if the site won't give us the page
+        """
+        logging.info("Fetching listing for %s%s", self.get_base_url(), href)
+        headers = saved[0] if saved is not None else None
+        resp = self.request_url(self.get_base_url() + href, headers=headers)
+        # request_url already retried the errors worth retrying, and a
+        # listing that's gone won't load however long it's given
+        if resp.status_code not in (200, 304):
+            raise ListingUnavailable("Got a {} for {}{}".format(
+                    resp.status_code, self.get_base_url(), href))
+        return resp
 
     def request_city_listing(self, city, state, pageNum = 1):
         """ Gets a specific page number of the results for a city
             :returns: a BeautifulSoup object of the results page
         """
-        logging.info("Getting page #{} of results for {}, {}".format(
-                pageNum, city, state))
+        logging.info("Getting page #%d of results for %s, %s", pageNum, city, state)
         cityParam = {"q": "{}, {}, USA".format(city, state), "page": pageNum}
         resp = self.request_url(self.get_base_search_url(), params=cityParam)
         return self.soupify(resp)
 
     def soupify(self, resp):
         """ Creates and returns a BeautifulSoup object for an html page """
-        return BeautifulSoup(resp.text, "html.parser")
+        with self.metrics.timer('parse'):
+            return BeautifulSoup(resp.text, self.parser)
 
-    def get_hrefs(self, soup):
-        """ Finds all the hrefs of listings from a search result page
-            :returns: the hrefs of all the listings on a search result page
+    def get_cards(self, soup):
+        """ :returns: the href and data-spu of each listing on a search
+                      result page
         """
         rawListingIDs = soup.find_all('div', attrs={"data-spu": True})
-        hrefs = [ id.find('a')['href'] for id in rawListingIDs if id.find('a') ]
-        return hrefs
+        return [ (id.find('a')['href'], id['data-spu'])
+                 for id in rawListingIDs if id.find('a') ]
 
     def get_base_search_url(self):
         return self.BASE_SEARCH_URL
@@ -370,10 +938,11 @@ class CityScrape:
     def get_ajax_url(self):
         return self.AJAX_URL
 
-    def get_page_count(self, city, state):
-        """ Returns the number of pages of results for a city """
-        logging.info("Determining page count for {}, {}".format(city, state))
-        soup = self.request_city_listing(city, state)
+    def read_page_count(self, soup, city, state):
+        """ Returns the number of pages of results, from the first page of
+            them for a city
+        """
+        logging.info("Determining page count for %s, %s", city, state)
         scripts = soup.find_all('script')
         scripts = list(filter(lambda script: script.attrs == {} and 'pageCount' in script.text,
                               scripts))
@@ -384,31 +953,264 @@ class CityScrape:
         assert(len(pageCountNum) != 0 and "Didn't find pageCount in script tag: {}, {}".format(city, state))
         # findall returns a list, so we want the first item
         # in the list and make it an int
-        logging.info("Page count is {}".format(pageCountNum[0]))
+        logging.info("Page count is %s", pageCountNum[0])
         return int(pageCountNum[0])
 
-    def request_url(self, url, params=None):
-        notSuccessful = True
-        resp = None
-        while notSuccessful:
+    def request_url(self, url, params=None, headers=None):
+        if self.cache is not None:
+            resp = self.cache.get(url, params, allow_expired=self.replay)
+            if resp is not None:
+                self.metrics.count('cache_hits')
+                return resp
+            if self.replay:
+                raise CacheMiss("{} isn't in the cache".format(
+                        self.cache.get_full_url(url, params)))
+
+        for attempt in range(self.retry_policy.max_attempts):
+            self.rate_limiter.wait()
             try:
-                resp = requests.get(url, timeout=5, allow_redirects=True, params=params)
-                notSuccessful = False
-            except ConnectionError:
-                logging.error("Could not get page {}. Re-trying...".format(url))
-                time.sleep(2)
-            except Exception as e:
-                logging.error("Unknown error occurred when requesting {}.\n {}".format(url, e))
-                time.sleep(2)
-        return resp
+                with self.metrics.timer('network'):
+                    resp = self.session.get(url, timeout=5, allow_redirects=True,
+                                            params=params, headers=headers)
+            except requests.exceptions.RequestException as e:
+                logging.error("Could not get page %s. Re-trying...\n %s", url, e)
+                self.rate_limiter.on_throttle()
+                self.retries += 1
+                self.metrics.count('retries')
+                time.sleep(self.retry_policy.get_delay(attempt))
+                continue
+
+            if resp.status_code == 429 or resp.status_code >= 500:
+                retryAfter = parse_retry_after(resp.headers.get('Retry-After'))
+                logging.error("Got a %d for %s. Slowing down and re-trying...",
+                              resp.status_code, url)
+                self.rate_limiter.on_throttle(retryAfter)
+                self.retries += 1
+                self.metrics.count('retries')
+                time.sleep(max(retryAfter or 0, self.retry_policy.get_delay(attempt)))
+                continue
+
+            self.rate_limiter.on_success()
+            self.metrics.count('bytes', len(resp.content))
+            if self.cache is not None and resp.status_code == 200:
+                self.cache.put(url, params, resp)
+            return resp
+
+        raise RetriesExhausted("Gave up on {} after {} tries".format(
+                url, self.retry_policy.max_attempts))
+
+    def discard_cached(self, url, params=None):
+        """ Makes the next request for url fetch it again, unless we're
+            replaying, which never changes the cache
+        """
+        if self.cache is not None and not self.replay:
+            self.cache.discard(url, params)
 
 
+def get_city_dir(city, state):
+    """ returns the directory a city's files are saved in """
+    return "{city}_{state}".format(city=city.replace(' ', '_'), state=state)
+
+def pick_parser(parsers):
+    """ :returns: the first of parsers that BeautifulSoup has installed """
+    for parser in parsers:
+        try:
+            BeautifulSoup('', parser)
+            return parser
+        except FeatureNotFound:
+            pass
+    raise FeatureNotFound("None of the parsers {} are installed".format(parsers))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrapes VRBO listings and reviews by city")
+    parser.add_argument('--mode', choices=['sync', 'async', 'pipeline'], default='sync',
+                        help="sync fetches one page at a time, async fetches "
+                             "listings concurrently, pipeline also parses "
+                             "listings in a pool of processes")
+    parser.add_argument('--max-in-flight', type=int, default=8,
+                        help="max concurrent requests per host in async mode")
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help="connections to keep open per host (defaults to "
+                             "{} in sync mode and --max-in-flight in async "
+                             "mode)".format(CityScrape.DEFAULT_POOL_SIZE))
+    parser.add_argument('--parser', choices=CityScrape.PARSERS, default=None,
+                        help="BeautifulSoup parser for pages (defaults to the "
+                             "fastest one installed)")
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help="parser processes in pipeline mode (defaults to "
+                             "the number of cpus)")
+    parser.add_argument('--parse-queue-size', type=int, default=None,
+                        help="fetched listing pages that can wait for a "
+                             "parser in pipeline mode (defaults to twice "
+                             "--parse-workers)")
+    parser.add_argument('--checkpoint', default='last_info.ini',
+                        help="checkpoint file to resume from and save "
+                             "progress to. With --cities, the name of the one "
+                             "in each city's directory.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="skip listings that haven't changed since they "
+                             "were last written, and only add new reviews. "
+                             "Start each refresh with a new --checkpoint.")
+    parser.add_argument('--reviews-only', action='store_true',
+                        help="only scrape reviews, getting the id they're "
+                             "fetched by from the search results instead of "
+                             "each listing's page. With --mode async many "
+                             "listings' reviews are fetched at once, and with "
+                             "--incremental only the new ones are added.")
+    parser.add_argument('--cities', default=None,
+                        help="file with a 'City, ST' per line to scrape instead "
+                             "of CITY_LIST, with a checkpoint per city")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes to scrape the --cities in")
+    parser.add_argument('--cache-dir', default=None,
+                        help="cache responses in this directory and reuse "
+                             "them on later runs")
+    parser.add_argument('--cache-max-mb', type=int,
+                        default=ResponseCache.DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="size to keep the cached responses under")
+    parser.add_argument('--cache-ttl-hours', type=float,
+                        default=ResponseCache.DEFAULT_TTL / 3600,
+                        help="hours before a cached response is fetched again")
+    parser.add_argument('--replay', action='store_true',
+                        help="only use responses in --cache-dir, even expired "
+                             "ones, and never go to the network")
+    parser.add_argument('--checkpoint-every', type=int,
+                        default=CityScrape.DEFAULT_CHECKPOINT_EVERY,
+                        help="listings to write between saving progress")
+    parser.add_argument('--checkpoint-seconds', type=float,
+                        default=CityScrape.DEFAULT_CHECKPOINT_SECONDS,
+                        help="most seconds to go between saving progress")
+    parser.add_argument('--rate', type=float, default=AdaptiveRateLimiter.DEFAULT_RATE,
+                        help="requests/second to start at. The rate rises "
+                             "while the site responds normally and halves "
+                             "when it pushes back.")
+    parser.add_argument('--max-rate', type=float, default=AdaptiveRateLimiter.DEFAULT_MAX_RATE,
+                        help="requests/second to never go over")
+    parser.add_argument('--max-retries', type=int, default=RetryPolicy.DEFAULT_MAX_ATTEMPTS,
+                        help="tries at a request before giving up on it")
+    parser.add_argument('--review-page-size', type=int,
+                        default=CityScrape.DEFAULT_REVIEW_PAGE_SIZE,
+                        help="reviews to fetch per request")
+    parser.add_argument('--review-page-workers', type=int, default=1,
+                        help="pages of a listing's reviews to fetch at once")
+    parser.add_argument('--review-decoder', choices=ReviewDecoder.BACKENDS, default='auto',
+                        help="what decodes the json of the reviews. auto uses "
+                             "orjson if it's installed, and streams pages "
+                             "over {} MB with ijson if that is.".format(
+                                    ReviewDecoder.DEFAULT_STREAM_BYTES // 1024 ** 2))
+    parser.add_argument('--output', choices=list(SINKS), default='csv',
+                        help="format to write listings and reviews in. "
+                             "parquet keeps the column types and needs "
+                             "pyarrow installed. sqlite upserts every "
+                             "city into --database.")
+    parser.add_argument('--database', default='vrbo.sqlite',
+                        help="database --output sqlite writes to")
+    parser.add_argument('--write-batch-rows', type=int, default=FlushPolicy.DEFAULT_MAX_ROWS,
+                        help="rows a csv holds before writing them out")
+    parser.add_argument('--write-batch-kb', type=int,
+                        default=FlushPolicy.DEFAULT_MAX_BYTES // 1024,
+                        help="KB of rows a csv holds before writing them out")
+    parser.add_argument('--write-batch-seconds', type=float,
+                        default=FlushPolicy.DEFAULT_MAX_SECONDS,
+                        help="most seconds a csv holds a row before writing "
+                             "it out. Every checkpoint writes them out too.")
+    parser.add_argument('--validators', default='validators.sqlite',
+                        help="where the ETags and Last-Modifieds of listing "
+                             "pages are kept, so later crawls only download "
+                             "and parse the pages that changed. '' to always "
+                             "fetch them. Pages are always fetched whole "
+                             "with --cache-dir, so they can be replayed")
+    parser.add_argument('--seen-listings', default='seen_listings.sqlite',
+                        help="where the listings scraped are kept, so a "
+                             "listing that shows up for several cities is "
+                             "only fetched once. '' to fetch it every time.")
+    parser.add_argument('--seen-max-hours', type=float,
+                        default=SeenListings.DEFAULT_MAX_AGE / 3600,
+                        help="hours a scraped listing is reused for other "
+                             "cities. Keep it below the time between crawls.")
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                        help="how the log file is written. json writes a json "
+                             "object per line, with the message before its "
+                             "arguments were put in as the event.")
+    parser.add_argument('--log-backups', type=int, default=DEFAULT_LOG_BACKUPS,
+                        help="logs of earlier runs to keep, as logfile.log.1 "
+                             "and so on. 0 to overwrite the log every run.")
+    parser.add_argument('--metrics-seconds', type=float,
+                        default=Metrics.DEFAULT_SUMMARY_SECONDS,
+                        help="seconds between logging how fast each stage is going")
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None,
+                        help="run the scrape under a profiler")
+    parser.add_argument('--profile-output', default=None,
+                        help="file to save the profile to (defaults to "
+                             "scrape.prof for cprofile and scrape.html for "
+                             "pyinstrument)")
+    args = parser.parse_args()
+    if args.replay and not args.cache_dir:
+        parser.error("--replay needs a --cache-dir to replay from")
+    if args.profile and not args.profile_output:
+        args.profile_output = 'scrape.prof' if args.profile == 'cprofile' else 'scrape.html'
+    return args
+
+def get_scraper(args, **kwargs):
+    """ Creates the scraper for args.mode. kwargs are passed on to it. """
+    kwargs['checkpoint_every'] = args.checkpoint_every
+    kwargs.setdefault('config_file', args.checkpoint)
+    kwargs['incremental'] = args.incremental
+    kwargs['reviews_only'] = args.reviews_only
+    kwargs['review_page_size'] = args.review_page_size
+    kwargs['rate_limiter'] = AdaptiveRateLimiter(rate=min(args.rate, args.max_rate),
+                                                 max_rate=args.max_rate)
+    kwargs['retry_policy'] = RetryPolicy(max_attempts=args.max_retries)
+    kwargs['review_page_workers'] = args.review_page_workers
+    kwargs['review_decoder'] = ReviewDecoder(args.review_decoder)
+    kwargs['checkpoint_seconds'] = args.checkpoint_seconds
+    kwargs['output'] = args.output
+    kwargs['database'] = args.database
+    kwargs['flush_policy'] = FlushPolicy(max_rows=args.write_batch_rows,
+                                         max_bytes=args.write_batch_kb * 1024,
+                                         max_seconds=args.write_batch_seconds)
+    kwargs['metrics'] = Metrics(summary_seconds=args.metrics_seconds)
+    kwargs['structured_log'] = args.log_format == 'json'
+    kwargs['log_backups'] = args.log_backups
+    if args.validators:
+        kwargs['validators'] = ValidatorStore(args.validators)
+    if args.seen_listings:
+        kwargs['seen_listings'] = SeenListings(args.seen_listings,
+                                               max_age=args.seen_max_hours * 3600)
+    if args.cache_dir:
+        kwargs['cache'] = ResponseCache(args.cache_dir,
+                                        max_bytes=args.cache_max_mb * 1024 ** 2,
+                                        ttl=args.cache_ttl_hours * 3600)
+        kwargs['replay'] = args.replay
+    if args.mode == 'pipeline':
+        from pipeline_scraper import PipelineCityScrape
+        return PipelineCityScrape(max_in_flight=args.max_in_flight,
+                                  pool_size=args.pool_size, parser=args.parser,
+                                  parse_workers=args.parse_workers,
+                                  parse_queue_size=args.parse_queue_size,
+                                  **kwargs)
+    if args.mode == 'async':
+        from async_scraper import AsyncCityScrape
+        return AsyncCityScrape(max_in_flight=args.max_in_flight,
+                               pool_size=args.pool_size, parser=args.parser,
+                               **kwargs)
+    return CityScrape(pool_size=args.pool_size or CityScrape.DEFAULT_POOL_SIZE,
+                      parser=args.parser, **kwargs)
+
 def main():
+    args = parse_args()
+    if args.cities:
+        from scheduler import read_city_list, scrape_cities
+        scrape_cities(args, read_city_list(args.cities), args.workers)
+        return
+
+    cityScraper = get_scraper(args)
     try:
-        cityScraper = CityScrape()
-        cityScraper.scrape()
+        run_profiled(cityScraper.scrape, args.profile, args.profile_output)
     except:
-        cityScraper.close_csvs()
+        logging.exception("Stopped scraping")
+        cityScraper.close_csvs(save_progress=False)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
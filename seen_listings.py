@@ -0,0 +1,61 @@
+""" The listings already scraped, with their reviews, so the cities that
+    overlap (San Jose, Sunnyvale and Santa Clara share most of theirs) can
+    have the same rows written for them without fetching the listing again.
+
+    Listings are kept by their listing id and the data-spu of their search
+    result, in an sqlite database the workers scraping other cities share.
+    A listing is only reused for max_age after it was scraped, so the next
+    crawl still gets fresh data. Listings with more than MAX_REVIEWS reviews
+    aren't kept, since their reviews would all have to be held in memory
+    until the listing is written.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class SeenListings:
+
+    DEFAULT_MAX_AGE = 24 * 60 * 60
+    MAX_REVIEWS = 500
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS listings (
+                                   listing_id TEXT,
+                                   spu TEXT,
+                                   scraped REAL,
+                                   city TEXT,
+                                   data BLOB,
+                                   PRIMARY KEY (listing_id, spu))""")
+
+    def get(self, listingId, spu):
+        """ :returns: the city the listing was scraped for, its row and its
+                      review rows, or None if it hasn't been scraped lately
+        """
+        with self.lock:
+            entry = self.db.execute("SELECT city, data FROM listings "
+                                    "WHERE listing_id = ? AND spu = ? AND scraped > ?",
+                                    (listingId, spu, time.time() - self.max_age)).fetchone()
+        if entry is None:
+            return None
+        city, data = entry
+        data = json.loads(zlib.decompress(data).decode('utf-8'))
+        return city, data['row'], data['reviews']
+
+    def put(self, listingId, spu, city, row, reviewRows):
+        data = json.dumps({'row': row, 'reviews': reviewRows}).encode('utf-8')
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                            (listingId, spu, time.time(), city, zlib.compress(data)))
+
+    def close(self):
+        self.db.close()
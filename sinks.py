@@ -0,0 +1,458 @@
+""" Where the listing and review rows of a city are written. Every sink takes
+    dict rows one at a time, and can say how much it has written so the
+    checkpoint journal can cut it back to that on resume. A sink can also
+    be marked, and rolled back to drop the rows written since, for a
+    listing that fails part way through its reviews.
+
+    CsvSink writes the csvs the scraper always has, in batches of rows
+    whenever its FlushPolicy says to. ParquetSink keeps the
+    types of the columns (prices, coordinates and stars stay numbers) and
+    writes them as parquet, which is much quicker to load back than csv.
+    SqliteSink upserts every city into one database that can be queried
+    without loading anything.
+"""
+
+import collections
+import csv
+import glob
+import logging
+import operator
+import os
+import sqlite3
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# columns that aren't strings, by the type their values are stored as
+INT_COLUMNS = {'number_reviews', 'average_nightly_price', 'nightly',
+               'weekend_night', 'property_protection_fee', 'cleaning_fee',
+               'min_stay', 'sleeps', 'bathrooms', 'member_since', 'floor',
+               'sq_footage', 'max_occupancy', 'total_number_reviews',
+               'n_review'}
+FLOAT_COLUMNS = {'latitude', 'longitude', 'average_rating', 'stars'}
+
+
+class FlushPolicy:
+    """ When a sink writes out the rows it's holding: once there are
+        max_rows of them, they come to about max_bytes, or the first of them
+        has waited max_seconds, whichever comes first
+    """
+
+    DEFAULT_MAX_ROWS = 1000
+    DEFAULT_MAX_BYTES = 1024 ** 2
+    DEFAULT_MAX_SECONDS = 5.0
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_seconds=DEFAULT_MAX_SECONDS):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+    def get_batch_rows(self, rowBytes):
+        """ :returns: how many rows of about rowBytes each to hold """
+        if not rowBytes:
+            return self.max_rows
+        return max(1, min(self.max_rows, int(self.max_bytes // rowBytes)))
+
+
+class CsvSink:
+    """ Writes rows to a csv. Rows are held in memory and written a batch
+        at a time when the flush policy says so or the sink is synced, with
+        a plain csv writer, which is quicker than DictWriter. The size of
+        the rows written so far says how many of them make max_bytes, so
+        holding a row costs no more than appending it.
+    """
+
+    EXTENSION = '.csv'
+    # whether every city is written to the same place
+    SHARED = False
+
+    def __init__(self, path, fieldnames, flush_policy=None):
+        self.path = path
+        self.flush_policy = flush_policy or FlushPolicy()
+        exists = os.path.exists(path)
+        self.file = open(path, 'a')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames,
+                                     quoting=csv.QUOTE_MINIMAL)
+        self.row_writer = csv.writer(self.file, quoting=csv.QUOTE_MINIMAL)
+        self.get_values = operator.itemgetter(*fieldnames)
+        if not exists:
+            self.writer.writeheader()
+        self.buffer = []
+        self.batch_rows = self.flush_policy.max_rows
+        self.written_rows = 0
+        self.written_bytes = 0
+        self.mark()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def writerow(self, row):
+        now = time.monotonic()
+        if not self.buffer:
+            self.buffered_since = now
+        self.buffer.append(row)
+        if (len(self.buffer) >= self.batch_rows or
+                now - self.buffered_since >= self.flush_policy.max_seconds):
+            self.flush()
+
+    def flush(self):
+        """ Writes the held rows to the file, without waiting for them to be
+            on disk
+        """
+        if self.buffer:
+            start = self.file.tell()
+            if self.mark_index is None:
+                self.write_rows(self.buffer)
+            else:
+                # where the marked rows end is only known once they're written
+                self.write_rows(self.buffer[:self.mark_index])
+                self.mark_offset = self.file.tell()
+                self.write_rows(self.buffer[self.mark_index:])
+                self.mark_index = None
+            self.written_rows += len(self.buffer)
+            self.written_bytes += self.file.tell() - start
+            self.batch_rows = self.flush_policy.get_batch_rows(self.written_bytes / self.written_rows)
+            self.buffer = []
+        self.file.flush()
+
+    def write_rows(self, rows):
+        try:
+            values = list(map(self.get_values, rows))
+        except KeyError:
+            # DictWriter leaves the columns a row doesn't have empty
+            self.writer.writerows(rows)
+        else:
+            self.row_writer.writerows(values)
+
+    def mark(self):
+        """ Notes where the rows written next start, for rollback """
+        self.mark_index = len(self.buffer)
+        self.mark_offset = None
+
+    def rollback(self):
+        """ Drops the rows written since mark was called """
+        if self.mark_index is not None:
+            del self.buffer[self.mark_index:]
+        else:
+            self.buffer = []
+            self.file.flush()
+            self.file.truncate(self.mark_offset)
+            self.file.seek(0, os.SEEK_END)
+        self.mark()
+
+    def sync(self):
+        """ Makes sure the rows written so far are on disk
+            :returns: the offset to truncate back to, to undo later rows
+        """
+        self.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def truncate(self, offset):
+        """ Drops the rows written after sync returned offset """
+        self.buffer = []
+        self.file.flush()
+        size = os.fstat(self.file.fileno()).st_size
+        if size > offset:
+            self.file.truncate(offset)
+        elif size < offset:
+            logging.error("%s is shorter than when it was checkpointed", self.path)
+        # truncating doesn't move the position tell() reports, which the
+        # next sync returns and flush measures the rows it writes by
+        self.file.seek(0, os.SEEK_END)
+        self.mark()
+
+    def read_rows(self):
+        """ Yields the rows written, with every value as a string """
+        self.flush()
+        with open(self.path, newline='') as rows:
+            yield from csv.DictReader(rows)
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+        self.file.close()
+
+
+def to_column_value(name, value):
+    """ :returns: value as the type of the column name, or None if it's
+                  missing or can't be converted
+    """
+    if value is None or value == '':
+        return None
+    convert = int if name in INT_COLUMNS else float if name in FLOAT_COLUMNS else str
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        logging.error("Couldn't store %r in the %s column", value, name)
+        return None
+
+def get_arrow_schema(fieldnames):
+    """ :returns: the pyarrow schema of the columns fieldnames """
+    def arrow_type(name):
+        if name in INT_COLUMNS:
+            return pyarrow.int64()
+        if name in FLOAT_COLUMNS:
+            return pyarrow.float64()
+        return pyarrow.string()
+    return pyarrow.schema([ (name, arrow_type(name)) for name in fieldnames ])
+
+
+class ParquetSink:
+    """ Buffers rows in typed columns and writes them as parquet. A parquet
+        file can't be appended to, or read until it's finished, so each
+        sync writes the buffered rows as the next part file of a directory
+        and the offset it returns is how many parts there are.
+    """
+
+    EXTENSION = '.parquet'
+    SHARED = False
+
+    def __init__(self, path, fieldnames):
+        if pyarrow is None:
+            raise ImportError("Writing parquet needs pyarrow installed")
+        self.path = path
+        self.fieldnames = fieldnames
+        self.schema = get_arrow_schema(fieldnames)
+        os.makedirs(path, exist_ok=True)
+        self.parts = len(self.get_part_paths())
+        self.clear_buffer()
+        self.closed = False
+
+    def clear_buffer(self):
+        self.columns = { name: [] for name in self.fieldnames }
+        self.buffered = 0
+        self.marked = 0
+
+    def get_part_path(self, partNum):
+        return os.path.join(self.path, 'part-{:05d}.parquet'.format(partNum))
+
+    def get_part_paths(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def writerow(self, row):
+        for name in self.fieldnames:
+            self.columns[name].append(to_column_value(name, row.get(name)))
+        self.buffered += 1
+
+    def mark(self):
+        """ Notes where the rows written next start, for rollback """
+        self.marked = self.buffered
+
+    def rollback(self):
+        """ Drops the rows buffered since mark was called. Only sync writes
+            rows out, and it's never called part way through a listing.
+        """
+        for values in self.columns.values():
+            del values[self.marked:]
+        self.buffered = self.marked
+
+    def sync(self):
+        """ Writes the buffered rows as a new part file
+            :returns: the number of parts, to truncate back to
+        """
+        if self.buffered:
+            table = pyarrow.Table.from_pydict(self.columns, schema=self.schema)
+            path = self.get_part_path(self.parts)
+            # write then rename, so a crash can't leave half a part behind
+            with open(path + '.tmp', 'wb') as partFile:
+                pyarrow.parquet.write_table(table, partFile)
+                partFile.flush()
+                os.fsync(partFile.fileno())
+            os.replace(path + '.tmp', path)
+            self.parts += 1
+            self.clear_buffer()
+        return self.parts
+
+    def truncate(self, offset):
+        """ Drops the buffered rows and the parts written after sync
+            returned offset
+        """
+        self.clear_buffer()
+        partPaths = self.get_part_paths()
+        if len(partPaths) < offset:
+            logging.error("%s has fewer parts than when it was checkpointed", self.path)
+        for path in partPaths[offset:]:
+            os.remove(path)
+        self.parts = min(offset, len(partPaths))
+
+    def read_rows(self):
+        """ Yields the rows on disk, with every value as a string like
+            CsvSink gives them
+        """
+        for path in self.get_part_paths():
+            for row in pyarrow.parquet.read_table(path).to_pylist():
+                yield { name: '' if value is None else str(value)
+                        for name, value in row.items() }
+
+    def close(self):
+        """ Writes out whatever is still buffered """
+        if not self.closed:
+            self.sync()
+            self.closed = True
+
+
+class SqliteSink:
+    """ Upserts rows into a table of an sqlite database every city is
+        written to. Rows are buffered and written in one transaction on each
+        sync, so a worker doesn't hold the database locked between
+        checkpoints. Writing the same listing or review again replaces it,
+        so resuming and rerunning don't leave duplicates and truncate only
+        has to drop what's buffered.
+    """
+
+    SHARED = True
+    # table -> (name, columns it's keyed by). A listing can show up for
+    # several cities, and each of them has its own copy of it like the
+    # csvs do.
+    TABLES = {'listing': ('listings', ('listing_id', 'city', 'state')),
+              'review': ('reviews', ('listing_id', 'city', 'state', 'n_review'))}
+    # table -> {index name: columns}, besides the one by city every table
+    # has. The key can't find a listing's reviews by number across cities.
+    INDEXES = {'reviews': {'reviews_listing_review': ('listing_id', 'n_review')}}
+
+    def __init__(self, path, fieldnames, table, city=None, state=None):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.table, self.key = self.TABLES[table]
+        # the city read_rows gives the rows of, or every city if None
+        self.city = city
+        self.state = state
+        self.buffer = []
+        self.marked = 0
+        self.written = 0
+        self.closed = False
+        # the workers scraping other cities write to the same database
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.create_table()
+
+    def get_column_type(self, name):
+        if name in INT_COLUMNS:
+            return 'INTEGER'
+        if name in FLOAT_COLUMNS:
+            return 'REAL'
+        return 'TEXT'
+
+    def create_table(self):
+        with self.db:
+            # the other workers wait while the table is made or changed
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+                    self.table, self.get_table_columns()))
+            # tables made before a column was added get it added now
+            existing = { info[1] for info in self.db.execute("PRAGMA table_info({})".format(self.table)) }
+            for name in self.fieldnames:
+                if name not in existing:
+                    self.db.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                            self.table, name, self.get_column_type(name)))
+            if self.get_table_key() != self.key:
+                self.rekey_table()
+            self.db.execute("CREATE INDEX IF NOT EXISTS {0}_city ON {0} (city, state)".format(self.table))
+            for name, columns in self.INDEXES.get(self.table, {}).items():
+                self.db.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                        name, self.table, ', '.join(columns)))
+
+    def get_table_columns(self):
+        """ :returns: the column definitions and primary key of the table """
+        columns = [ '{} {}'.format(name, self.get_column_type(name)) for name in self.fieldnames ]
+        return '{}, PRIMARY KEY ({})'.format(', '.join(columns), ', '.join(self.key))
+
+    def get_table_key(self):
+        """ :returns: the columns the table in the database is keyed by """
+        info = self.db.execute("PRAGMA table_info({})".format(self.table)).fetchall()
+        # the 6th field is the column's place in the primary key, 0 if it
+        # isn't in it
+        return tuple(name for place, name in sorted((column[5], column[1]) for column in info)
+                     if place)
+
+    def rekey_table(self):
+        """ Copies the rows of a table keyed by listing alone, like they were
+            before, into one keyed by city too
+        """
+        logging.info("Keying the %s in %s by city too", self.table, self.path)
+        old = self.table + '_unkeyed'
+        self.db.execute("DROP INDEX IF EXISTS {}_city".format(self.table))
+        self.db.execute("ALTER TABLE {} RENAME TO {}".format(self.table, old))
+        self.db.execute("CREATE TABLE {} ({})".format(self.table, self.get_table_columns()))
+        self.db.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2}".format(
+                self.table, ', '.join(self.fieldnames), old))
+        self.db.execute("DROP TABLE {}".format(old))
+
+    def writerow(self, row):
+        self.buffer.append(tuple(to_column_value(name, row.get(name))
+                                 for name in self.fieldnames))
+
+    def mark(self):
+        """ Notes where the rows written next start, for rollback """
+        self.marked = len(self.buffer)
+
+    def rollback(self):
+        """ Drops the rows buffered since mark was called. Only sync writes
+            rows out, and it's never called part way through a listing.
+        """
+        del self.buffer[self.marked:]
+
+    def sync(self):
+        """ Upserts the buffered rows in one transaction
+            :returns: how many rows have been written, which is only logged
+                      since rows written again just replace themselves
+        """
+        if self.buffer:
+            updates = [ '{0} = excluded.{0}'.format(name) for name in self.fieldnames
+                        if name not in self.key ]
+            with self.db:
+                self.db.executemany("INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) "
+                                    "DO UPDATE SET {}".format(
+                                        self.table, ', '.join(self.fieldnames),
+                                        ', '.join('?' * len(self.fieldnames)),
+                                        ', '.join(self.key), ', '.join(updates)),
+                                    self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = []
+            self.marked = 0
+        return self.written
+
+    def truncate(self, offset):
+        """ Drops the buffered rows. The ones already written will be
+            upserted again when their listings are.
+        """
+        self.buffer = []
+        self.marked = 0
+
+    def read_rows(self):
+        """ Yields the rows of the sink's city, or every row in the table if
+            it wasn't given one, with every value as a string like CsvSink
+            gives them
+        """
+        query = "SELECT {} FROM {}".format(', '.join(self.fieldnames), self.table)
+        if self.city is None:
+            cursor = self.db.execute(query)
+        else:
+            cursor = self.db.execute(query + " WHERE city = ? AND state = ?",
+                                     (self.city, self.state))
+        for values in cursor:
+            yield { name: '' if value is None else str(value)
+                    for name, value in zip(self.fieldnames, values) }
+
+    def close(self):
+        """ Writes out whatever is still buffered """
+        if not self.closed:
+            self.sync()
+            self.db.close()
+            self.closed = True
+
+
+# --output name -> sink class
+SINKS = collections.OrderedDict([
+    ('csv', CsvSink),
+    ('parquet', ParquetSink),
+    ('sqlite', SqliteSink),
+])